@@ -68,9 +68,9 @@ def new_voxel_plot(fig, ax, lattice):
     ax.set_ylim([0, lattice_dimensions[0] * 16])
     ax.set_zlim([0, lattice_dimensions[0] * 16])
     counter = 0
-    for x in range(20):
-        for y in range(20):
-            for z in range(20):
+    for x in range(lattice_dimensions[0]):
+        for y in range(lattice_dimensions[1]):
+            for z in range(lattice_dimensions[2]):
                 counter += 1
                 if lattice[x][y][z] == 2:
                     place_walls(ax, x, y, z)
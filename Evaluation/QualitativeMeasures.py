@@ -46,7 +46,7 @@ def symmetry(lattice, h_bound, v_bound, d_bound):
     symmetry += height_symmetry(lattice, h_bound, v_bound, d_bound)
     symmetry += width_symmetry(lattice, h_bound, v_bound, d_bound)
     symmetry += depth_symmetry(lattice, h_bound, v_bound, d_bound)
-    return symmetry / 12000
+    return symmetry / (3 * half_volume)
 
 
 def surface_ratio(lattice, h_bound, v_bound, d_bound):
@@ -1,13 +1,16 @@
 from multiprocessing import Pool
 import numpy as np
+import tensorflow as tf
 from keras.layers import Dense, Flatten, Reshape, Input, Conv2D, Conv2DTranspose, Conv3D, MaxPooling2D, UpSampling2D, \
                          MaxPooling3D, Conv3DTranspose, UpSampling3D
 from keras.models import Sequential, Model
+from keras.callbacks import EarlyStopping
 from sklearn.model_selection import train_test_split
 from keras.models import model_from_json
 
 from Generator.Delenox_Config import lattice_dimensions, batch_size, no_epochs, thread_count, value_range, current_run, \
-    compressed_length
+    compressed_length, encoding_batch_size, warm_start_patience
+from Generator.TrainingShards import TrainingShards
 from Generator.Visualization import auto_encoder_plot, visualize_training
 
 
@@ -21,7 +24,8 @@ def update_auto_encoder(ae, population):
     return ae
 
 
-def create_auto_encoder(model_type, phase, experiment, population=None, noisy=None, save=True):
+def create_auto_encoder(model_type, phase, experiment, population=None, noisy=None, save=True, shards=None,
+                        noise=None, previous=None, weights=None):
     """
     Function to create and train a de-noising auto-encoder to compress 3D lattices
     into a 1D latent vector representation.
@@ -31,6 +35,11 @@ def create_auto_encoder(model_type, phase, experiment, population=None, noisy=No
     :param noisy:
     :param model_type: type of auto-encoder to create (2D vs 3D)
     :param population: population of lattices to train the model on (given when performing Delenox)
+    :param shards: TrainingShards streamed from disk to train the model on, instead of a population in memory.
+    :param noise: function adding noise to each batch of training lattices, such as add_noise_batch.
+    :param previous: names of the encoder and decoder whose weights the models start from, in which case training
+    stops early once the validation loss plateaus.
+    :param weights: sample weights of the population's lattices, e.g. their number of copies before deduplication.
     :return: the generated encoder and decoder models
     """
     ae, encoder_model, decoder_model = model_type(compressed_length)
@@ -39,19 +48,44 @@ def create_auto_encoder(model_type, phase, experiment, population=None, noisy=No
     encoder_name = "encoder"
     decoder_name = "decoder"
 
-    if noisy is None:
-        noisy = population
-    else:
+    if noisy is not None or noise is not None:
         encoder_name += "_noisy"
         decoder_name += "_noisy"
+    if noisy is None:
+        noisy = population
+
+    callbacks = []
+    if previous is not None:
+        encoder_model.load_weights(previous[0] + ".h5")
+        decoder_model.load_weights(previous[1] + ".h5")
+        callbacks.append(EarlyStopping(monitor='val_loss', patience=warm_start_patience, restore_best_weights=True))
+
+    if population is not None and noise is not None:
+        # Noise is drawn afresh for every batch, so no noisy copy of the population is kept alongside it.
+        shards = TrainingShards([population], weights=None if weights is None else [weights])
+        population = None
 
     if population is not None:
         # If the function is given a population of lattices, create a set of noisy variants and partition into train-test.
         # training_noisy, test_noisy, training, test = train_test_split(population, population, test_size=0.2, random_state=29)
-        train_noisy, test_noisy, training, test = train_test_split(noisy, population, test_size=0.2, random_state=29)
-
-        history = ae.fit(x=train_noisy, y=training, epochs=no_epochs,
-                         batch_size=batch_size, validation_data=(test_noisy, test), shuffle=True)
+        if weights is None:
+            train_noisy, test_noisy, training, test = train_test_split(noisy, population, test_size=0.2,
+                                                                       random_state=29)
+            history = ae.fit(x=train_noisy, y=training, epochs=no_epochs,
+                             batch_size=batch_size, validation_data=(test_noisy, test), shuffle=True,
+                             callbacks=callbacks)
+        else:
+            # Weights are given one axis per voxel axis so they broadcast over the loss of every voxel.
+            weights = np.reshape(weights, (-1,) + (1,) * (np.ndim(population) - 2))
+            train_noisy, test_noisy, training, test, train_weights, test_weights = train_test_split(
+                noisy, population, weights, test_size=0.2, random_state=29)
+            history = ae.fit(x=train_noisy, y=training, sample_weight=train_weights, epochs=no_epochs,
+                             batch_size=batch_size, validation_data=(test_noisy, test, test_weights), shuffle=True,
+                             callbacks=callbacks)
+        visualize_training(history, phase, experiment)
+    elif shards is not None:
+        history = ae.fit(x=shards.training(batch_size, noise), epochs=no_epochs,
+                         validation_data=shards.validation(batch_size, noise), callbacks=callbacks)
         visualize_training(history, phase, experiment)
 
     if save:
@@ -68,34 +102,43 @@ def create_auto_encoder(model_type, phase, experiment, population=None, noisy=No
 def auto_encoder_3d(compressed_length):
     """
     Function to create the structure of a 3D auto-encoder, using a series of convolution and sampling layers.
-    This model is specifically designed to take a lattice with resolution (20x20x20).
+    At a resolution of (20x20x20) the convolutions reduce the lattice to a single latent vector.  At larger
+    resolutions a dense layer at the inner most ends of the encoder and decoder keeps the latent vector at the
+    desired size, and the decoder's last kernel is widened so that it reconstructs the full lattice.
 
     :param compressed_length: desired latent vector size.
     :return: auto-encoder model, as well as the encoder and decoder separately.
     """
+    input_shape = tuple(lattice_dimensions) + (5,)
+    final_conv_shape = tuple(((((dimension - 2) // 2 - 1) // 2) - 2) // 2 for dimension in lattice_dimensions)
+    final_kernel = tuple(dimension - 8 * final - 9 for dimension, final in zip(lattice_dimensions, final_conv_shape))
 
     # Constructing the model for the encoder
     encoder_model = Sequential(name="Encoder_"+str(compressed_length))
-    encoder_model.add(Conv3D(compressed_length / 4, kernel_size=(3, 3, 3), activation='relu', input_shape=(20, 20, 20, 5)))
+    encoder_model.add(Conv3D(compressed_length / 4, kernel_size=(3, 3, 3), activation='relu', input_shape=input_shape))
     encoder_model.add(MaxPooling3D((2, 2, 2), strides=(2, 2, 2)))
     encoder_model.add(Conv3D(compressed_length / 2, kernel_size=(2, 2, 2), activation='relu'))
     encoder_model.add(MaxPooling3D((2, 2, 2), strides=(2, 2, 2)))
     encoder_model.add(Conv3D(compressed_length, kernel_size=(3, 3, 3), activation='relu'))
     encoder_model.add(MaxPooling3D((2, 2, 2), strides=(2, 2, 2)))
     encoder_model.add(Flatten())
+    if final_conv_shape != (1, 1, 1):
+        encoder_model.add(Dense(compressed_length))
 
     # Constructing the model for the decoder
     decoder_model = Sequential(name="Decoder_"+str(compressed_length))
-    decoder_model.add(Reshape((1, 1, 1, compressed_length)))
+    if final_conv_shape != (1, 1, 1):
+        decoder_model.add(Dense(compressed_length * int(np.prod(final_conv_shape))))
+    decoder_model.add(Reshape(final_conv_shape + (compressed_length, )))
     decoder_model.add(UpSampling3D(size=(2, 2, 2)))
     decoder_model.add(Conv3DTranspose(compressed_length / 2, kernel_size=(3, 3, 3), activation='relu'))
     decoder_model.add(UpSampling3D(size=(2, 2, 2)))
     decoder_model.add(Conv3DTranspose(compressed_length / 4, kernel_size=(2, 2, 2), activation='relu'))
     decoder_model.add(UpSampling3D(size=(2, 2, 2)))
-    decoder_model.add(Conv3DTranspose(5, kernel_size=(3, 3, 3), activation='sigmoid'))
+    decoder_model.add(Conv3DTranspose(5, kernel_size=final_kernel, activation='sigmoid'))
 
     # Combining the two models into the auto-encoder model
-    ae_input = Input((20, 20, 20, 5))
+    ae_input = Input(input_shape)
     ae_encoder_output = encoder_model(ae_input)
     ae_decoder_output = decoder_model(ae_encoder_output)
     ae = Model(ae_input, ae_decoder_output)
@@ -228,6 +271,44 @@ def compress_lattices(lattices, encoder):
     return np.asarray(compressed)
 
 
+def encode_lattices(encoder, lattices, batch=encoding_batch_size):
+    """
+    Compress lattices with the given encoder, a batch at a time.  Only one batch is stacked into an array at
+    once, so a long list of lattices, or an array memory-mapped from disk with np.load(path, mmap_mode='r'), is
+    streamed through the encoder without being copied into memory as a whole.
+
+    :param encoder: model to compress the lattices.
+    :param lattices: sequence of one-hot encoded lattices.
+    :param batch: number of lattices passed to each call of the encoder.
+    :return: list of latent vectors, in the same order as the lattices.
+    """
+    compressed = []
+    for start in range(0, len(lattices), batch):
+        compressed.extend(encoder.predict(np.asarray(lattices[start:start + batch]), batch_size=batch))
+    return compressed
+
+
+def inference_function(encoder, batch=encoding_batch_size):
+    """
+    Wrap an encoder in a compiled inference function.  The signature leaves the number of lattices open, so the
+    graph is traced once and then re-used by every call, whatever its size, without padding the inputs and
+    without the per-call setup of Model.predict.
+
+    :param encoder: model to compress the lattices.
+    :param batch: maximum number of lattices evaluated by each call of the compiled function.
+    :return: function mapping an array of one-hot encoded lattices to their array of latent vectors.
+    """
+    signature = [tf.TensorSpec((None,) + tuple(encoder.input_shape[1:]), tf.float32)]
+    compiled = tf.function(lambda lattices: encoder(lattices, training=False), input_signature=signature)
+
+    def encode(lattices):
+        lattices = np.asarray(lattices, dtype=np.float32)
+        compressed = [compiled(lattices[start:start + batch]).numpy() for start in range(0, len(lattices), batch)]
+        return np.concatenate(compressed) if compressed else np.zeros((0,) + tuple(encoder.output_shape[1:]))
+
+    return encode
+
+
 def add_noise_parallel(lattices, name=None):
     """
     Multi-process approach to adding noise to a population of lattices, outputting the
@@ -251,6 +332,19 @@ def add_noise_parallel(lattices, name=None):
     return np.asarray(noisy_lattices)
 
 
+def add_noise_batch(lattices, generator=np.random):
+    """
+    Vectorized equivalent of add_noise over a batch of lattices.
+
+    :param lattices: batch of lattices to be noised.
+    :param generator: random number generator drawing the noise, e.g. a RandomState seeded for the batch.
+    :return: array of noisy lattices.
+    """
+    noisy_lattices = np.array(lattices, copy=True)
+    noisy_lattices[generator.random_sample(noisy_lattices.shape[:4]) < 0.025] = 0
+    return noisy_lattices
+
+
 def add_noise(lattice):
     """
     Function to add noise to any given lattice using a set noise method.
@@ -261,11 +355,7 @@ def add_noise(lattice):
     :param lattice: lattice to be noised.
     :return: noisy lattice.
     """
-    noisy_lattice = lattice.copy()
-    for (x, y, z) in value_range:
-        if np.random.random() < 0.025:
-            noisy_lattice[x][y][z] = 0
-    return noisy_lattice
+    return add_noise_batch(np.asarray(lattice)[None])[0]
 
 
 def test_accuracy(encoder, decoder, test, mean=True):
@@ -292,6 +382,24 @@ def test_accuracy(encoder, decoder, test, mean=True):
         return np.round(error, 2)
 
 
+def reconstruction_error(encoder, decoder, lattices, batch=encoding_batch_size):
+    """
+    Batched equivalent of test_accuracy, reading only one batch of lattices into memory at a time.
+
+    :param encoder: encoder that will compress the lattices.
+    :param decoder: decoder that will reconstruct the lattices from the compressed representation.
+    :param lattices: sequence of one-hot encoded lattices, e.g. a memory-mapped training set shard.
+    :param batch: number of lattices reconstructed by each call of the models.
+    :return: mean categorical error observed.
+    """
+    error = []
+    for start in range(0, len(lattices), batch):
+        original = np.asarray(lattices[start:start + batch])
+        reconstructed = decoder.predict(encoder.predict(original, batch_size=batch), batch_size=batch)
+        error.extend(np.mean(np.argmax(original, axis=-1) != np.argmax(reconstructed, axis=-1), axis=(1, 2, 3)) * 100)
+    return np.round(np.mean(error), 2)
+
+
 def calculate_error(original, reconstruction):
     """
     Function to calculate the error rate between an original lattice and its reconstructed counterpart.
@@ -302,11 +410,8 @@ def calculate_error(original, reconstruction):
     :param reconstruction: reconstructed version generated through the auto-encoder model.
     :return: categorical error.
     """
-    error = 0
-    for (x, y, z) in value_range:
-        if np.argmax(original[x][y][z]) != np.argmax(reconstruction[x][y][z]):
-            error += 1
-    return round(error / (lattice_dimensions[0] ** 3) * 100, 2)
+    error = np.count_nonzero(np.argmax(original, axis=-1) != np.argmax(reconstruction, axis=-1))
+    return round(error / np.prod(lattice_dimensions) * 100, 2)
 
 
 def convert_to_integer(lattice):
@@ -316,16 +421,8 @@ def convert_to_integer(lattice):
     :param lattice: lattice of one-hot material vectors.
     :return: lattice of integer material codes.
     """
-    integer_reconstruct = np.zeros(lattice_dimensions)
-    for channel in range(20):
-        for row in range(20):
-            integer_reconstruct[channel][row] = np.argmax(lattice[channel][row], axis=1)
-    return integer_reconstruct
+    return np.asarray(np.argmax(lattice, axis=-1), dtype=float)
 
 
 def convert_to_ones(lattice):
-    new_lattice = np.zeros(lattice.shape)
-    for (x, y, z) in value_range:
-        if lattice[x][y][z] > 0:
-            new_lattice[x][y][z] = 1
-    return new_lattice
\ No newline at end of file
+    return np.asarray(np.asarray(lattice) > 0, dtype=float)
\ No newline at end of file
@@ -0,0 +1,239 @@
+from Generator.Delenox_Config import *
+
+
+def sigmoid_array(z):
+    z = np.clip(5.0 * z, -60.0, 60.0)
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def sinc_array(z):
+    z = np.clip(5.0 * z, -60.0, 60.0)
+    return (np.sin(z) + 1) / 2
+
+
+def gauss_array(z):
+    z = np.clip(z, -3.4, 3.4)
+    return np.exp(-5.0 * z ** 2)
+
+
+def tanh_array(z):
+    return np.tanh(np.clip(2.5 * z, -60.0, 60.0))
+
+
+def sin_array(z):
+    return np.sin(np.clip(5.0 * z, -60.0, 60.0))
+
+
+def relu_array(z):
+    return np.where(z > 0.0, z, 0.0)
+
+
+def identity_array(z):
+    return z
+
+
+def clamped_array(z):
+    return np.clip(z, -1.0, 1.0)
+
+
+def abs_array(z):
+    return np.abs(z)
+
+
+def hat_array(z):
+    return np.maximum(0.0, 1 - np.abs(z))
+
+
+def square_array(z):
+    return z ** 2
+
+
+def cube_array(z):
+    return z ** 3
+
+
+# Array counterparts of the activation functions available to the CPPNs, keyed by the name used in neat.cfg.
+# Any activation missing from this table is evaluated element-wise with the genome's own scalar function.
+array_activations = {'sigmoid': sigmoid_array, 'sin_adjusted': sinc_array, 'gauss': gauss_array,
+                     'tanh': tanh_array, 'sin': sin_array, 'relu': relu_array, 'identity': identity_array,
+                     'clamped': clamped_array, 'abs': abs_array, 'hat': hat_array, 'square': square_array,
+                     'cube': cube_array}
+
+# Outputs closer than this to the rounding threshold are re-evaluated with the scalar network, which guarantees
+# the rounded lattice is identical to the one produced by neat's FeedForwardNetwork.
+rounding_tolerance = 1e-6
+
+
+class CompiledCPPN:
+    """
+    Array form of the feed-forward network encoded by a CPPN-NEAT genome.  Every node is evaluated once for a
+    whole grid of coordinates instead of once per voxel, following the same node order and summation order as
+    neat's FeedForwardNetwork so that the rendered lattices match the per-voxel implementation.
+    """
+    def __init__(self, genome, config):
+        self.network = neat.nn.FeedForwardNetwork.create(genome, config)
+        self.program = []
+        for node, activation_function, aggregation_function, bias, response, links in self.network.node_evals:
+            activation = genome.nodes[node].activation
+            aggregation = genome.nodes[node].aggregation
+            if activation in array_activations:
+                array_function = array_activations[activation]
+            else:
+                array_function = np.vectorize(activation_function, otypes=[float])
+            self.program.append((node, activation, array_function, aggregation, aggregation_function, bias,
+                                 response, links))
+
+    def topology(self):
+        """
+        Structural signature of the compiled network, ignoring weights, biases and responses.  Hidden nodes are
+        identified by their position in the evaluation order, so networks built from different innovation numbers
+        but with the same structure share a signature and can be evaluated together.
+        :return: hashable description of the node order, activations, aggregations and links.
+        """
+        names = {key: ('Input', key) for key in self.network.input_nodes}
+        names.update({key: ('Output', key) for key in self.network.output_nodes})
+        signature = []
+        for position, (node, activation, _, aggregation, _, _, _, links) in enumerate(self.program):
+            names.setdefault(node, ('Hidden', position))
+            signature.append((names[node], activation, aggregation, tuple(names[key] for key, _ in links)))
+        return tuple(signature)
+
+    def activate(self, inputs):
+        """
+        Evaluate the network on arrays of input values.
+        :param inputs: one array per input node, all sharing the same shape.
+        :return: list containing one array of output values per output node.
+        """
+        return evaluate_program(self.program, self.network.input_nodes, self.network.output_nodes, inputs)
+
+    def round_output(self, output, coordinates):
+        """
+        Round the raw output of the network into a lattice.  Voxels on the rounding threshold are recomputed with
+        the scalar network to settle any last-bit differences between numpy's and Python's implementations of the
+        transcendental functions.
+        :param output: array of output values for every voxel.
+        :param coordinates: the input arrays the output was computed from.
+        :return: lattice of rounded CPPN outputs.
+        """
+        lattice = np.round(output)
+        for (x, y, z) in zip(*np.nonzero(np.abs(output - 0.5) < rounding_tolerance)):
+            lattice[x][y][z] = np.round(self.network.activate((coordinates[0][x][y][z], coordinates[1][x][y][z],
+                                                              coordinates[2][x][y][z]))[0])
+        return lattice
+
+    def render(self, dimensions=lattice_dimensions, height=None):
+        """
+        Generate the (un-repaired) lattice of this CPPN by querying every voxel of the given grid in one pass.
+        :param dimensions: resolution of the lattice to render.
+        :param height: number of layers to render from the ground up, or None for the whole lattice.
+        :return: lattice of rounded CPPN outputs.
+        """
+        coordinates = coordinate_grid(dimensions, height)
+        return self.round_output(self.activate(coordinates)[0], coordinates)
+
+
+def evaluate_program(program, input_nodes, output_nodes, inputs):
+    """
+    Run a compiled CPPN program over arrays of inputs.  The biases, responses and weights of the program may
+    themselves be arrays with a leading batch axis, in which case a whole group of networks sharing the same
+    topology is evaluated at once and every output gains that batch axis.
+    :param program: list of compiled node evaluations, in evaluation order.
+    :param input_nodes: keys of the input nodes.
+    :param output_nodes: keys of the output nodes.
+    :param inputs: one array per input node, all sharing the same shape.
+    :return: list containing one array of output values per output node.
+    """
+    shape = np.shape(inputs[0])
+    values = {key: np.zeros(shape) for key in input_nodes + output_nodes}
+    for key, value in zip(input_nodes, inputs):
+        values[key] = value
+
+    for node, _, array_function, aggregation, aggregation_function, bias, response, links in program:
+        if aggregation == 'sum':
+            # Accumulate in the same order as Python's sum() so the floating point result is unchanged.
+            total = np.zeros(shape)
+            for key, weight in links:
+                total = total + values[key] * weight
+        elif links:
+            node_inputs = np.stack(np.broadcast_arrays(*[values[key] * weight for key, weight in links]))
+            total = np.apply_along_axis(aggregation_function, 0, node_inputs)
+        else:
+            total = np.full(shape, aggregation_function([]))
+        values[node] = array_function(bias + response * total)
+
+    return [values[key] for key in output_nodes]
+
+
+def coordinate_grid(dimensions=lattice_dimensions, height=None):
+    """
+    Build the CPPN inputs for every voxel of a lattice, matching the x / y / z scaling used by the per-voxel path.
+    :param dimensions: resolution of the lattice.
+    :param height: number of layers to include from the ground up, or None for the whole lattice.
+    :return: list of three coordinate arrays, indexed [x][y][z].
+    """
+    axes = [np.arange(size) / dimensions[0] for size in dimensions]
+    return np.meshgrid(axes[0], axes[1], axes[2][:height], indexing='ij')
+
+
+def render_lattice(genome, config):
+    """
+    Generate the lattice encoded by the given CPPN genome using the compiled array network.
+    :param genome: CPPN object used to generate the lattice.
+    :param config: CPPN-NEAT config file specifying the parameters for the genomes.
+    :return: lattice of rounded CPPN outputs.
+    """
+    return CompiledCPPN(genome, config).render()
+
+
+def render_lattices(genomes, config, dimensions=lattice_dimensions, height=None):
+    """
+    Generate the lattices of a batch of CPPN genomes.  Genomes are grouped by the topology of their compiled
+    network and each group is evaluated as a single tensor program, stacking the weights, biases and responses
+    of its members along a leading batch axis.
+    :param genomes: CPPN objects used to generate the lattices.
+    :param config: CPPN-NEAT config file specifying the parameters for the genomes.
+    :param dimensions: resolution of the lattices to render.
+    :param height: number of layers to render from the ground up, or None for the whole lattice.
+    :return: list of lattices of rounded CPPN outputs, in the same order as the genomes.
+    """
+    compiled = [CompiledCPPN(genome, config) for genome in genomes]
+    groups = {}
+    for index, cppn in enumerate(compiled):
+        groups.setdefault(cppn.topology(), []).append(index)
+
+    coordinates = coordinate_grid(dimensions, height)
+    batch_shape = (-1,) + (1,) * len(coordinates[0].shape)
+    lattices = [None] * len(compiled)
+    for indices in groups.values():
+        members = [compiled[index] for index in indices]
+        program = []
+        for position, (node, activation, array_function, aggregation, aggregation_function, _, _, links) in \
+                enumerate(members[0].program):
+            biases = np.reshape([member.program[position][5] for member in members], batch_shape)
+            responses = np.reshape([member.program[position][6] for member in members], batch_shape)
+            weighted_links = [(key, np.reshape([member.program[position][7][link][1] for member in members],
+                                               batch_shape)) for link, (key, _) in enumerate(links)]
+            program.append((node, activation, array_function, aggregation, aggregation_function, biases, responses,
+                            weighted_links))
+
+        output = evaluate_program(program, members[0].network.input_nodes, members[0].network.output_nodes,
+                                  coordinates)[0]
+        output = np.broadcast_to(output, (len(members),) + coordinates[0].shape)
+        for index, member, member_output in zip(indices, members, output):
+            lattices[index] = member.round_output(member_output, coordinates)
+    return lattices
+
+
+def render_lattice_per_voxel(genome, config):
+    """
+    Reference implementation which activates the CPPN once per voxel of the lattice.
+    :param genome: CPPN object used to generate the lattice.
+    :param config: CPPN-NEAT config file specifying the parameters for the genomes.
+    :return: lattice of rounded CPPN outputs.
+    """
+    net = neat.nn.FeedForwardNetwork.create(genome, config)
+    lattice = np.zeros(lattice_dimensions)
+    for (x, y, z) in value_range:
+        lattice[x][y][z] = np.round(
+            net.activate((x / lattice_dimensions[0], y / lattice_dimensions[0], z / lattice_dimensions[0]))[0])
+    return lattice
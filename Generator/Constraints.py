@@ -1,3 +1,5 @@
+from scipy import ndimage
+
 from Generator.Delenox_Config import *
 from Generator.ErrorHandling import *
 
@@ -11,6 +13,36 @@ door_frames_ns = [
     np.array([[[3, 1, 1, 1], [3, 2, 2, 2]], [[3, 1, 1, 1], [3, 2, 2, 2]], [[3, 1, 1, 1], [3, 2, 2, 2]]])
 ]
 
+# Every door frame template in the order they are tried, and the columns (relative to the frame's corner)
+# which are hollowed out to open the doorway when the template matches.
+door_frames = door_frames_ns + door_frames_ew
+door_openings = [[(1, 0), (1, 1)]] * len(door_frames_ns) + [[(0, 1), (1, 1)]] * len(door_frames_ew)
+
+# Number of voxels in half of the lattice, used to normalise the symmetry measures
+half_volume = np.prod(lattice_dimensions) / 2
+
+# Number of layers above the ground spanned by the door frame templates
+door_height = door_frames_ns[0].shape[2]
+
+
+def entrance_possible(ground_layers):
+    """
+    Cheap necessary condition for a rendered lattice to survive the constraints, evaluated on its lowest
+    layers only.  Repairing a lattice never turns an empty voxel solid, so a building can only receive an
+    entrance if the unrepaired lattice already has a solid block the size of a door frame resting on the ground.
+    If no such block exists the lattice is certainly infeasible (this also covers lattices with nothing on
+    the ground for the flood fill to start from).
+    :param ground_layers: unrepaired lattice, or at least its lowest door_height layers.
+    :return: False if the lattice can be rejected without rendering it in full.
+    """
+    solid = np.asarray(ground_layers)[:, :, :door_height] != 0
+    for shape in {frame.shape for frame in door_frames}:
+        if any(np.greater(shape, solid.shape)):
+            continue
+        if np.lib.stride_tricks.sliding_window_view(solid, shape).all(axis=(3, 4, 5)).any():
+            return True
+    return False
+
 
 def apply_constraints(lattice):
     """
@@ -28,6 +60,103 @@ def apply_constraints(lattice):
         return False, lattice
 
 
+def apply_constraints_batch(lattices, timings=None):
+    """
+    Apply the pipeline's constraints to a whole stack of lattices at once, running the flood fill, material
+    identification, entrance placement and quality checks across the batch.  Infeasible lattices are returned
+    as far as their repair got, matching apply_constraints.
+    :param lattices: stack of lattices of shape (N, X, Y, Z) generated by CPPN-NEAT genomes.
+    :param timings: optional dictionary accumulating the seconds spent in each stage of the repair.
+    :return: repaired stack, feasibility of each lattice and, for each infeasible lattice, the name of the
+    constraint that rejected it (None for feasible lattices).
+    """
+    lattices = np.asarray(lattices)
+    start = time.time()
+    repaired, grounded = iterative_flood_batch(lattices)
+    start = record_stage(timings, 'Flood', start)
+    repaired = identify_materials(repaired)
+    record_stage(timings, 'Materials', start)
+    repaired, reasons = assess_quality_batch(repaired, timings)
+    repaired[~grounded] = lattices[~grounded]
+    reasons[~grounded] = InfeasibleError.__name__
+    return repaired, np.equal(reasons, None), reasons
+
+
+def iterative_flood_batch(lattices):
+    """
+    Batched counterpart of iterative_flood.  The structures of every lattice are labelled in one pass (without
+    connecting voxels across lattices), and the largest grounded structure of each lattice is kept, breaking ties
+    in favour of the structure seeded first on the ground plane.
+    :param lattices: stack of lattices of shape (N, X, Y, Z).
+    :return: stack of kept structures, and whether each lattice had any structure touching the ground.
+    """
+    structure = np.zeros((3, 3, 3, 3), bool)
+    structure[1] = ndimage.generate_binary_structure(3, 1)
+    components, _ = ndimage.label(lattices != 0, structure=structure)
+
+    # Structures seeded on the ground, with the flat position of their first seed across the whole batch.
+    ground = np.where(lattices[..., 0] == 1, components[..., 0], 0).ravel()
+    structures, first_seen = np.unique(ground, return_index=True)
+    structures, first_seen = structures[structures != 0], first_seen[structures != 0]
+    owners = first_seen // np.prod(lattices.shape[1:3])
+    sizes = np.bincount(components.ravel())[structures]
+
+    # Largest structure of each lattice, with ties going to the earliest seed.
+    order = np.lexsort((first_seen, -sizes, owners))
+    owners = owners[order]
+    largest = np.r_[True, owners[1:] != owners[:-1]] if len(owners) else np.zeros(0, bool)
+    keep = np.zeros(len(lattices), components.dtype)
+    keep[owners[largest]] = structures[order][largest]
+
+    grounded = keep != 0
+    kept = (components == keep[:, None, None, None]) & grounded[:, None, None, None]
+    return np.asarray(kept, dtype=int), grounded
+
+
+def assess_quality_batch(lattices, timings=None):
+    """
+    Batched counterpart of assess_quality, placing an entrance in every lattice that can have one.
+    :param lattices: stack of material lattices of shape (N, X, Y, Z), updated in place.
+    :param timings: optional dictionary accumulating the seconds spent in each stage of the assessment.
+    :return: stack with entrances added, and the name of the failed constraint for each lattice (or None).
+    """
+    start = time.time()
+    reasons = np.full(len(lattices), None, dtype=object)
+    empty = np.count_nonzero(lattices, axis=(1, 2, 3)) == 0
+    reasons[empty] = InfeasibleVoxelCount.__name__
+    start = record_stage(timings, 'Quality', start)
+
+    # The first matching template of each lattice, in the same scanning order as place_entrance.
+    candidates = entrance_candidates(lattices).transpose(0, 2, 3, 1)
+    candidates = candidates.reshape(len(lattices), int(np.prod(candidates.shape[1:])))
+    has_entrance = candidates.any(axis=1) & ~empty
+    reasons[~empty & ~has_entrance] = InfeasibleEntrance.__name__
+    x, y, frame = np.unravel_index(np.argmax(candidates, axis=1), lattices.shape[1:3] + (len(door_frames), ))
+
+    items = np.flatnonzero(has_entrance)
+    openings = np.asarray(door_openings)[frame[items]]
+    door_x = x[items, None] + openings[..., 0]
+    door_y = y[items, None] + openings[..., 1]
+    lattices[items[:, None], door_x, door_y, 1] = 1
+    lattices[items[:, None], door_x, door_y, 2] = 1
+    record_stage(timings, 'Entrance', start)
+    return lattices, reasons
+
+
+def record_stage(timings, stage, start):
+    """
+    Add the time elapsed since start to the running total of the given stage.
+    :param timings: dictionary of seconds spent per stage, or None if timings are not being collected.
+    :param stage: name of the stage that just finished.
+    :param start: time at which the stage started.
+    :return: the current time, i.e. the start of the next stage.
+    """
+    now = time.time()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + now - start
+    return now
+
+
 def assess_quality(lattice):
     """
     Assess the quality of the given lattice, determining its feasibility and returning a list of metrics.
@@ -109,35 +238,64 @@ def place_entrance(lattice):
     """
     Checks whether the given lattice contains a possible entrance at ground level,
     by comparing it to existing door frames and seeing if at least one of the
-    templates fit somewhere in the space.
+    templates fit somewhere in the space.  The first match in scanning order is used.
     :param lattice: Lattice being checked.
     :return: lattice with entrance added, boolean result of check.
     """
-    for x in range(20):
-        for y in range(20):
-            if lattice[x][y][0] == 3:
-                for frame in door_frames_ns:
-                    if np.array_equal(frame, lattice[x:x + 3, y:y + 2, 0:4]):
-                        lattice[x + 1][y][1] = 1
-                        lattice[x + 1][y][2] = 1
-                        lattice[x + 1][y + 1][1] = 1
-                        lattice[x + 1][y + 1][2] = 1
-                        return lattice, True
-                for frame in door_frames_ew:
-                    if np.array_equal(frame, lattice[x:x + 2, y:y + 3, 0:4]):
-                        lattice[x][y + 1][1] = 1
-                        lattice[x][y + 1][2] = 1
-                        lattice[x + 1][y + 1][1] = 1
-                        lattice[x + 1][y + 1][2] = 1
-                        return lattice, True
-    return lattice, False
+    entrances = find_entrances(lattice)
+    if not entrances:
+        return lattice, False
+    return open_entrance(lattice, entrances[0]), True
+
+
+def find_entrances(lattice):
+    """
+    Find every position at which a door frame template fits the lattice.  Entrances are ordered as the
+    lattice is scanned: by x, then y, then by the template's position in door_frames.
+    :param lattice: Lattice being checked.
+    :return: list of (x, y, frame) tuples, where frame indexes door_frames.
+    """
+    return [tuple(entrance) for entrance in np.argwhere(entrance_candidates(lattice).transpose(1, 2, 0))]
+
+
+def entrance_candidates(lattice):
+    """
+    Compare every door frame template against every ground position of the lattice in a single sliding
+    window pass per template.  Leading axes are treated as a stack of lattices.
+    :param lattice: Lattice (or stack of lattices) being checked.
+    :return: boolean array of shape (..., len(door_frames), X, Y) marking the corners where each template fits.
+    """
+    lattice = np.asarray(lattice)
+    candidates = np.zeros(lattice.shape[:-3] + (len(door_frames), ) + lattice.shape[-3:-1], bool)
+    for index, frame in enumerate(door_frames):
+        if any(np.greater(frame.shape, lattice.shape[-3:])):
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(lattice[..., :frame.shape[2]], frame.shape,
+                                                           axis=(-3, -2, -1))
+        matches = (windows == frame).all(axis=(-3, -2, -1))[..., 0]
+        candidates[..., index, :matches.shape[-2], :matches.shape[-1]] = matches
+    return candidates
+
+
+def open_entrance(lattice, entrance):
+    """
+    Hollow out the doorway of a matched door frame, two voxels high.
+    :param lattice: Lattice the entrance was found in, updated in place.
+    :param entrance: (x, y, frame) tuple as returned by find_entrances.
+    :return: lattice with entrance added.
+    """
+    x, y, frame = entrance
+    for dx, dy in door_openings[frame]:
+        lattice[x + dx][y + dy][1] = 1
+        lattice[x + dx][y + dy][2] = 1
+    return lattice
 
 
 def bounding_box(lattice):
-    left_bound = 20
+    left_bound = lattice_dimensions[0]
     right_bound = 0
     near_bound = 0
-    far_bound = 20
+    far_bound = lattice_dimensions[1]
     bottom_bound = 0
     top_bound = 0
     for (x, y, z) in value_range:
@@ -220,7 +378,7 @@ def height_symmetry(lattice, horizontal_bounds, vertical_bounds, depth_bounds):
             for z in range(vertical_bounds[0], int(vertical_bounds[1] / 2)):
                 if lattice[x][y][z] == lattice[x][y][int(vertical_bounds[1] / 2) + z]:
                     symmetry_count += 1
-    return symmetry_count / 4000
+    return symmetry_count / half_volume
 
 
 def width_symmetry(lattice, horizontal_bounds, vertical_bounds, depth_bounds):
@@ -231,7 +389,7 @@ def width_symmetry(lattice, horizontal_bounds, vertical_bounds, depth_bounds):
             for z in range(vertical_bounds[0], vertical_bounds[1]):
                 if lattice[x][y][z] == lattice[int(width / 2) + x][y][z]:
                     symmetry_count += 1
-    return symmetry_count / 4000
+    return symmetry_count / half_volume
 
 
 def depth_symmetry(lattice, horizontal_bounds, vertical_bounds, depth_bounds):
@@ -242,7 +400,7 @@ def depth_symmetry(lattice, horizontal_bounds, vertical_bounds, depth_bounds):
             for z in range(vertical_bounds[0], vertical_bounds[1]):
                 if lattice[x][y][z] == lattice[x][int(depth / 2) + y][z]:
                     symmetry_count += 1
-    return symmetry_count / 4000
+    return symmetry_count / half_volume
 
 
 def stability(lattice):
@@ -284,7 +442,7 @@ def fill_tiny_gaps(input_lattice):
                 input_lattice[i][j][k] = 2
             # Otherwise drill upward till the next solid block is found and count the air voxels.
             else:
-                for drill in range(k+1, 20):
+                for drill in range(k+1, input_lattice.shape[2]):
                     if input_lattice[i][j][drill] == 1:
                         visited[i][j][drill] = 1
                     else:
@@ -294,26 +452,24 @@ def fill_tiny_gaps(input_lattice):
 
 def iterative_flood(input_lattice):
     """
-    Given an input lattice perform an exhaustive flood-fill algorithm from the bottom of the
-    XY plane to identify any floating voxels detached from the building inside lattice.
-    Also detects separate structures and labels them accordingly.
+    Given an input lattice identify the 6-connected structures of solid voxels which are seeded
+    from the bottom of the XY plane, removing any floating voxels detached from the building and
+    keeping only the largest grounded structure.  Ties are broken in favour of the structure whose
+    first seed comes first when scanning the ground plane row by row.
     :param input_lattice: original lattice generated by CPPN-NEAT genome.
     :return: original lattice with floating voxels removed.
     """
-    visited = np.zeros(input_lattice.shape, int)
-    label = 0
-
-    for i in range(0, visited.shape[0]):
-        for j in range(0, visited.shape[1]):
-            if visited[i][j][0] == 0 and input_lattice[i][j][0] == 1:
-                label += 1
-                visited, _ = detect_structure(input_lattice, visited, label, (i, j, 0))
+    components, _ = ndimage.label(input_lattice != 0, structure=ndimage.generate_binary_structure(3, 1))
 
-    visited = keep_largest_structure(visited, label)
-    if label == 0:
+    # Structures in the order their first seed is met on the ground plane.
+    seeds = components[:, :, 0][input_lattice[:, :, 0] == 1]
+    if seeds.size == 0:
         raise InfeasibleError
+    _, first_seen = np.unique(seeds, return_index=True)
+    structures = seeds[np.sort(first_seen)]
 
-    return visited
+    sizes = np.bincount(components.ravel())[structures]
+    return np.asarray(components == structures[np.argmax(sizes)], dtype=int)
 
 
 def detect_structure(lattice, visited, label, coordinate, any_type=True):
@@ -328,6 +484,7 @@ def detect_structure(lattice, visited, label, coordinate, any_type=True):
     to_fill = set()
     to_fill.add(coordinate)
     counter = 0
+    bounds = (lattice.shape[0] - 1, lattice.shape[1] - 1, lattice.shape[2] - 1)
 
     # Keep looping whilst the set of remaining unvisited voxels is empty.
     while len(to_fill) != 0:
@@ -338,15 +495,15 @@ def detect_structure(lattice, visited, label, coordinate, any_type=True):
         # If the voxel is active, mark it as true in the boolean grid and add it's neighbors
         if (lattice[voxel[0]][voxel[1]][voxel[2]] != 0 and any_type) or (not any_type and lattice[voxel[0]][voxel[1]][voxel[2]] == 1):
             visited[voxel[0]][voxel[1]][voxel[2]] = label
-            if voxel[0] < 19 and not visited[voxel[0] + 1][voxel[1]][voxel[2]]:
+            if voxel[0] < bounds[0] and not visited[voxel[0] + 1][voxel[1]][voxel[2]]:
                 to_fill.add((voxel[0] + 1, voxel[1], voxel[2]))
             if voxel[0] > 0 and not visited[voxel[0] - 1][voxel[1]][voxel[2]]:
                 to_fill.add((voxel[0] - 1, voxel[1], voxel[2]))
-            if voxel[1] < 19 and not visited[voxel[0]][voxel[1] + 1][voxel[2]]:
+            if voxel[1] < bounds[1] and not visited[voxel[0]][voxel[1] + 1][voxel[2]]:
                 to_fill.add((voxel[0], voxel[1] + 1, voxel[2]))
             if voxel[1] > 0 and not visited[voxel[0]][voxel[1] - 1][voxel[2]]:
                 to_fill.add((voxel[0], voxel[1] - 1, voxel[2]))
-            if voxel[2] < 19 and not visited[voxel[0]][voxel[1]][voxel[2] + 1]:
+            if voxel[2] < bounds[2] and not visited[voxel[0]][voxel[1]][voxel[2] + 1]:
                 to_fill.add((voxel[0], voxel[1], voxel[2] + 1))
             if voxel[2] > 0 and not visited[voxel[0]][voxel[1]][voxel[2] - 1]:
                 to_fill.add((voxel[0], voxel[1], voxel[2] - 1))
@@ -364,73 +521,48 @@ def keep_largest_structure(visited, label):
     if label == 0:
         return visited
 
-    # number_of_voxels contains the number of each of the labeled voxels
-    number_of_voxels = np.zeros(label, int)
-
-    for i in range(0, number_of_voxels.shape[0]):
-        number_of_voxels[i] = np.count_nonzero(visited == i + 1)
-
-    # keeps the pointer of the max voxels from the array number_of_voxels
-    most_voxels = np.where(number_of_voxels == np.amax(number_of_voxels))
+    # number_of_voxels contains the number of each of the labeled voxels, counted in a single pass
+    number_of_voxels = np.bincount(np.ravel(visited), minlength=label + 1)[1:label + 1]
 
     # the label that has the most voxels in the visited matrix
-    keep_voxel = most_voxels[0][0] + 1
+    keep_voxel = np.argmax(number_of_voxels) + 1
 
     # set the rest of the voxels to 0 and the keep_voxel elements to 1
-    for i in range(0, visited.shape[0]):
-        for j in range(0, visited.shape[1]):
-            for k in range(0, visited.shape[2]):
-                if visited[i][j][k] != 0 and not visited[i][j][k] == keep_voxel:
-                    visited[i][j][k] = 0
-                elif visited[i][j][k] != 0 and visited[i][j][k] == keep_voxel:
-                    visited[i][j][k] = 1
-
+    visited[:] = visited == keep_voxel
     return visited
 
 
 def identify_materials(lattice):
     """
-
-    :param lattice:
-    :return:
+    Assign materials to the solid voxels of a lattice, or of every lattice in a stack of shape (N, X, Y, Z),
+    using shifted boolean masks of each voxel's six neighbours. Ground voxels become floor, or are removed if
+    nothing stands on them.  Voxels with nothing above them (or on the top layer) become roof.  Otherwise voxels
+    on the sides of the lattice or next to empty space become walls, and those with nothing below become floor.
+    Removing a ground voxel is the only write which empties a voxel, and it only happens when the voxel above is
+    already empty, so no other decision ever depends on the order in which the voxels are visited.
+    :param lattice: lattice (or stack of lattices) labelled by the flood fill, updated in place.
+    :return: lattice of material codes.
     """
-    for x, y, z in value_range:
-        if lattice[x][y][z] != 0:
-
-            if z == 0:
-                if lattice[x][y][z + 1] == 0:
-                    lattice[x][y][z] = 0
-                else:
-                    lattice[x][y][z] = materials['Floor']
-                continue
-            elif z == lattice_dimensions[0] - 1:
-                lattice[x][y][z] = materials['Roof']
-                continue
-            else:
-                if lattice[x][y][z + 1] == 0:
-                    lattice[x][y][z] = materials['Roof']
-                    continue
-
-                if lattice[x][y][z - 1] == 0:
-                    if lattice[x][y][z + 1] == 0:
-                        lattice[x][y][z] = 0
-                    else:
-                        lattice[x][y][z] = materials['Floor']
-
-            if x == 0 or y == 0:
-                lattice[x][y][z] = materials['Wall']
-            try:
-                if lattice[x + 1][y][z] == 0:
-                    lattice[x][y][z] = materials['Wall']
-                elif lattice[x - 1][y][z] == 0:
-                    lattice[x][y][z] = materials['Wall']
-                elif lattice[x][y + 1][z] == 0:
-                    lattice[x][y][z] = materials['Wall']
-                elif lattice[x][y - 1][z] == 0:
-                    lattice[x][y][z] = materials['Wall']
-            except IndexError:
-                lattice[x][y][z] = materials['Wall']
-
+    solid = lattice != 0
+    above = np.zeros(solid.shape, bool)
+    above[..., :-1] = solid[..., 1:]
+    below = np.zeros(solid.shape, bool)
+    below[..., 1:] = solid[..., :-1]
+
+    # Voxels on the lateral boundary of the lattice, or with an empty neighbour on the X or Y axis.
+    exposed = np.ones(solid.shape, bool)
+    exposed[..., 1:-1, 1:-1, :] = ~(solid[..., 2:, 1:-1, :] & solid[..., :-2, 1:-1, :] &
+                                    solid[..., 1:-1, 2:, :] & solid[..., 1:-1, :-2, :])
+
+    height = np.arange(solid.shape[-1])
+    ground = height == 0
+    top = height == solid.shape[-1] - 1
+
+    materials_lattice = np.select(
+        [ground & above, ground, top | ~above, exposed, ~below],
+        [materials['Floor'], materials['External_Space'], materials['Roof'], materials['Wall'], materials['Floor']],
+        lattice)
+    lattice[solid] = materials_lattice[solid]
     return lattice
 
 
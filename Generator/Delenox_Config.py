@@ -25,8 +25,8 @@ target_species_count = 5
 # Parameters for input space of un/compressed buildings
 lattice_dimensions = (20, 20, 20)
 activations = np.linspace(0, 1, lattice_dimensions[0])
-value_range = [(x, y, z) for x in range(lattice_dimensions[0]) for y in range(lattice_dimensions[0]) for z in
-               range(lattice_dimensions[0])]
+value_range = [(x, y, z) for x in range(lattice_dimensions[0]) for y in range(lattice_dimensions[1]) for z in
+               range(lattice_dimensions[2])]
 
 # Auto-Encoder parameters for architecture and learning
 batch_size = 64
@@ -34,6 +34,34 @@ no_epochs = 100
 compressed_length = 256
 loss_function = "categorical_crossentropy"
 accuracy_metrics = ['categorical_accuracy', 'binary_accuracy']
+# Number of lattices compressed by a single call to the encoder when encoding many lattices at once
+encoding_batch_size = 256
+# Run the encoder in a dedicated process shared by every NEAT run, which micro-batches requests from all of them
+inference_server = False
+# Number of producers which may be connected to the inference server at once
+inference_clients = 4
+# Maximum number of seconds the inference server waits for more requests to fill a batch
+inference_timeout = 0.05
+# Let each pool worker load the phase's encoder and return latent vectors with compact lattices, so only a
+# fraction of each lattice is sent back to the coordinating process
+fused_workers = False
+# Stream the training sets of every phase from disk a batch at a time when training the auto-encoder, rather
+# than stacking the full training history in memory
+streaming_training = False
+# Initialise each phase's auto-encoder with the weights of the previous phase's encoder and decoder, and stop
+# training once the validation loss has not improved for warm_start_patience epochs
+warm_start = False
+warm_start_patience = 5
+# Number of lattices replayed from previous phases when training on the full history, or None to replay every one
+replay_capacity = None
+# Split of the replayed lattices across previous phases: 'uniform' (equal share) or 'proportional' (to their size)
+replay_sampling = 'uniform'
+# Also measure the reconstruction error of each phase's auto-encoder on the training set of every phase so far
+replay_report = False
+# Train the auto-encoder on one copy of each building, treating mirrored and rotated buildings as copies
+deduplicate_training = False
+# Weight each building kept by deduplication by its number of copies
+duplicate_weights = False
 
 # NEAT parameters for building generation and evolution
 runs_per_phase = 10
@@ -42,9 +70,39 @@ best_fit_count = int(1000 / runs_per_phase)
 generations_per_run = 100
 current_run = 0
 
+# Evaluate CPPNs over the whole coordinate grid at once rather than activating the network once per voxel
+vectorized_rendering = True
+# Number of genomes rendered together by a single pool task, grouped by CPPN topology
+render_batch_size = 20
+# Reject genomes which cannot have an entrance by rendering only their lowest layers before the full lattice
+ground_prescreen = True
+# Number of genomes whose repaired lattice and latent vector are kept between generations
+lattice_cache_size = 1000
+
 # Parameters for constrained novelty search in the NEAT module
 k_nearest_neighbors = 20
 add_to_archive = 2
+# Nearest neighbour backend used to search the novelty archive: 'brute' (exhaustive) or 'tree' (ball tree)
+novelty_index = 'brute'
+# Maximum number of individuals kept in the novelty archive, or None for an unbounded archive
+archive_capacity = None
+# Individual evicted from a full archive: 'fifo' (oldest), 'reservoir' (random sample) or 'least_novel'
+archive_eviction = 'fifo'
+# Number of the most novel individuals archived in each phase which are never evicted
+archive_exemplars = 0
+# Also score every generation against an unbounded archive and record how far the bounded scores shift
+archive_shift_report = False
+# Precision of the latent vectors stored in the archive and lattice cache: 'float32', 'float16' or 'int8'
+latent_precision = 'float32'
+# Also compare every generation's novelty against full precision latent vectors, recording neighbour changes
+latent_precision_report = False
+# Project latent vectors to a lower dimensional space before computing novelty: None, 'pca' or 'random'
+novelty_projection = None
+projection_dimensions = 32
+# Generations between refits of the projection, or 0 to fit it once at the start of each phase
+projection_refit = 0
+# Also compute the exact novelty of every generation and record its rank correlation with the projected novelty
+projection_report = False
 
 # Parameters for evolutionary algorithm using latent vector space
 latent_mutation_rate = 0.1
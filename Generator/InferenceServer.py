@@ -0,0 +1,159 @@
+import queue
+import time
+from collections import deque
+from multiprocessing import Process, Queue
+
+import numpy as np
+
+from Generator.Delenox_Config import encoding_batch_size, inference_clients, inference_timeout
+
+
+def serve(requests, responses, batch, timeout):
+    """
+    Main loop of the inference process.  Encoding requests from every client are gathered into micro-batches,
+    which are closed as soon as they hold a full batch of lattices or the oldest request has waited for the
+    timeout, and are compressed with a single call to the current encoder.
+    :param requests: queue of ('Load', client, request, path), ('Encode', client, request, lattices) and
+    ('Stop',) messages.
+    :param responses: one queue of (request, result) pairs per client.
+    :param batch: number of lattices compressed by each call to the encoder.
+    :param timeout: maximum number of seconds a request waits for others to share its batch.
+    """
+    from Generator.Autoencoder import load_model, inference_function
+
+    encode = None
+    encoder_path = None
+    backlog = deque()
+    while True:
+        message = backlog.popleft() if backlog else requests.get()
+        if message[0] == 'Stop':
+            break
+        if message[0] == 'Load':
+            _, client, request, path = message
+            try:
+                if path != encoder_path:
+                    encode = inference_function(load_model(path), batch)
+                    encoder_path = path
+                responses[client].put((request, None))
+            except Exception as error:
+                responses[client].put((request, error))
+            continue
+
+        waiting = [message]
+        count = len(message[3])
+        deadline = time.time() + timeout
+        while count < batch:
+            try:
+                message = backlog.popleft() if backlog else requests.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if message[0] != 'Encode':
+                backlog.appendleft(message)
+                break
+            waiting.append(message)
+            count += len(message[3])
+
+        try:
+            latents = encode(np.concatenate([lattices for _, _, _, lattices in waiting]).astype(np.float32))
+        except Exception as error:
+            latents = None
+            for _, client, request, _ in waiting:
+                responses[client].put((request, error))
+        if latents is not None:
+            offset = 0
+            for _, client, request, lattices in waiting:
+                responses[client].put((request, latents[offset:offset + len(lattices)]))
+                offset += len(lattices)
+
+
+def compact_lattices(lattices):
+    """
+    One-hot lattices are sent to the server as booleans rather than float32, which pickles a quarter of the
+    bytes; the server casts them back before encoding.
+    :param lattices: array of one-hot encoded lattices.
+    :return: the lattices as a boolean array, or unchanged if they are not all zeros and ones.
+    """
+    lattices = np.asarray(lattices)
+    if lattices.dtype != bool and np.array_equal(lattices, lattices != 0):
+        return lattices != 0
+    return lattices
+
+
+class InferenceServer:
+    """
+    Long-lived process owning the current encoder, shared by every NeatGenerator of an experiment so the model
+    is only loaded once per phase.  Producers submit lattices through EncoderClient handles and receive their
+    latent vectors asynchronously, so generation can carry on while earlier lattices are being encoded.
+    """
+    def __init__(self, clients=inference_clients, batch=encoding_batch_size, timeout=inference_timeout):
+        self.requests = Queue()
+        self.responses = [Queue() for _ in range(clients)]
+        self.free = list(range(clients))
+        self.process = Process(target=serve, args=(self.requests, self.responses, batch, timeout), daemon=True)
+        self.process.start()
+
+    def connect(self, encoder_path):
+        """
+        :param encoder_path: path of the encoder to use, which the server loads unless it is already in use.
+        :return: an EncoderClient handle, to be returned with disconnect once the caller is done with it.
+        """
+        if not self.free:
+            raise RuntimeError("All {:d} inference server clients are connected; disconnect one or raise "
+                               "inference_clients.".format(len(self.responses)))
+        client = EncoderClient(self.free.pop(0), self.requests, self.responses)
+        client.load(encoder_path)
+        return client
+
+    def disconnect(self, client):
+        self.free.append(client.client)
+
+    def stop(self):
+        self.requests.put(('Stop',))
+        self.process.join()
+
+
+class EncoderClient:
+    """
+    Handle used to send lattices to an InferenceServer.  Also provides the predict method of a Keras model so it
+    can stand in for the encoder, e.g. in encode_lattices.
+    """
+    def __init__(self, client, requests, responses):
+        self.client = client
+        self.requests = requests
+        self.responses = responses[client]
+        self.count = 0
+        self.results = {}
+
+    def load(self, encoder_path):
+        self.count += 1
+        self.requests.put(('Load', self.client, self.count, encoder_path))
+        self.result(self.count)
+
+    def submit(self, lattices):
+        """
+        :param lattices: array of one-hot encoded lattices.
+        :return: identifier of the request, to be passed to result.
+        """
+        self.count += 1
+        self.requests.put(('Encode', self.client, self.count, compact_lattices(lattices)))
+        return self.count
+
+    def result(self, request):
+        """
+        Wait for the result of a request, keeping any other results received in the meantime.
+        :param request: identifier returned by submit.
+        :return: array of latent vectors of the submitted lattices.
+        """
+        while request not in self.results:
+            received, value = self.responses.get()
+            self.results[received] = value
+        value = self.results.pop(request)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def encode(self, lattices):
+        return self.result(self.submit(lattices))
+
+    def predict(self, lattices, batch_size=None):
+        return self.encode(lattices)
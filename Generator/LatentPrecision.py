@@ -0,0 +1,109 @@
+import numpy as np
+from scipy.stats import spearmanr
+
+from Generator.Delenox_Config import latent_precision, k_nearest_neighbors
+
+# Storage type of the latent vectors for each precision mode.  int8 vectors are stored with one scale per vector.
+latent_dtypes = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+
+
+def quantize(vectors, precision=latent_precision):
+    """
+    Convert latent vectors to their storage precision.  int8 quantization is symmetric and per vector: each
+    vector is divided by the smallest power of two which brings its largest absolute value within 127 and is
+    rounded to the nearest integer.  Power of two scales make dequantization exact, so quantizing a vector which
+    was already read back from int8 storage returns the same values.
+    :param vectors: array of latent vectors of shape (..., D).
+    :param precision: one of the keys of latent_dtypes.
+    :return: the quantized vectors and their float32 scales of shape (...), which are one unless using int8.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if precision == 'int8':
+        largest = np.max(np.abs(vectors), axis=-1)
+        scales = np.exp2(np.ceil(np.log2(np.where(largest > 0, largest, 127) / 127))).astype(np.float32)
+        codes = np.clip(np.round(vectors / scales[..., None]), -127, 127).astype(np.int8)
+        return codes, scales
+    return vectors.astype(latent_dtypes[precision]), np.ones(vectors.shape[:-1], dtype=np.float32)
+
+
+def dequantize(codes, scales):
+    """
+    :param codes: quantized latent vectors of shape (..., D).
+    :param scales: float32 scales of the vectors, of shape (...).
+    :return: float32 latent vectors represented by the quantized ones.
+    """
+    return codes.astype(np.float32) * scales[..., None]
+
+
+def round_trip(vectors, precision=latent_precision):
+    """
+    :param vectors: array of latent vectors.
+    :param precision: one of the keys of latent_dtypes.
+    :return: the float32 vectors obtained by storing the given ones at the given precision and reading them back.
+    """
+    if precision == 'float32':
+        return np.asarray(vectors)
+    return dequantize(*quantize(vectors, precision))
+
+
+def quantized_distances(queries, codes, scales):
+    """
+    Euclidean distances from full precision queries to quantized vectors, expanding |q - s * c|^2 into
+    |q|^2 + s^2 |c|^2 - 2 s (q . c) so the quantized codes are only ever multiplied, never dequantized.  The
+    expansion is accumulated in float64, as in float32 the cancellation between its terms swamps the small
+    distances to the nearest neighbours.
+    :param queries: float32 latent vectors of shape (N, D).
+    :param codes: quantized latent vectors of shape (1, M, D), or (N, M, D) for a separate set per query.
+    :param scales: float32 scales of the quantized vectors, of shape (1, M) or (N, M).
+    :return: array of distances of shape (N, M), and a boolean array marking vectors identical to their query
+    once dequantized.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    values = codes.astype(np.float64)
+    wide_scales = scales.astype(np.float64)
+    dots = np.matmul(queries.astype(np.float64)[:, None, :], np.swapaxes(values, 1, 2))[:, 0, :] * wide_scales
+    squared = np.sum(np.square(queries, dtype=np.float64), axis=1)[:, None] + \
+        np.square(wide_scales) * np.sum(np.square(values), axis=2) - 2 * dots
+    identical = np.all(queries[:, None, :] == codes.astype(np.float32) * scales[..., None], axis=2)
+    return np.sqrt(np.maximum(squared, 0)).astype(np.float32), identical
+
+
+def precision_report(population, archive, precision=latent_precision, k=k_nearest_neighbors):
+    """
+    Compare the novelty of a generation computed from full precision latent vectors with the novelty computed
+    after storing the vectors of the population and the archive at a reduced precision.
+    :param population: full precision latent vectors of the generation.
+    :param archive: full precision latent vectors of the archive.
+    :param precision: the reduced precision to assess.
+    :param k: number of nearest neighbours defining novelty.
+    :return: dictionary of the fraction of individuals whose k nearest neighbours change, the rank correlation
+    of the two novelty scorings and whether the most novel individual changes.
+    """
+    population = np.asarray(population, dtype=np.float32).reshape(len(population), -1)
+    archive = np.asarray(archive, dtype=np.float32).reshape(-1, population.shape[1])
+    neighbours = np.concatenate([population, archive])
+
+    results = []
+    for queries, vectors in [(population, neighbours), (round_trip(population, precision),
+                                                        round_trip(neighbours, precision))]:
+        queries = queries.astype(float)
+        vectors = vectors.astype(float)
+        squared = np.sum(np.square(queries), 1)[:, None] + np.sum(np.square(vectors), 1)[None] - 2 * queries @ \
+            vectors.T
+        distances = np.sqrt(np.maximum(squared, 0))
+        rows = {}
+        for row, vector in enumerate(vectors):
+            rows.setdefault((vector + 0.0).tobytes(), []).append(row)
+        for query, vector in enumerate(queries):
+            distances[query, rows.get((vector + 0.0).tobytes(), [])] = np.inf
+        count = min(k, distances.shape[1])
+        nearest = np.argsort(distances, axis=1, kind='stable')[:, :count]
+        scores = np.take_along_axis(distances, nearest, axis=1)
+        scores = [np.average(row[np.isfinite(row)]) if np.isfinite(row).any() else 0 for row in scores]
+        results.append((nearest, np.asarray(scores)))
+
+    (full_nearest, full_scores), (reduced_nearest, reduced_scores) = results
+    changed = [set(full) != set(reduced) for full, reduced in zip(full_nearest, reduced_nearest)]
+    return {'Top-k Changed': round(float(np.mean(changed)), 3),
+            'Rank Correlation': round(float(spearmanr(full_scores, reduced_scores)[0]), 3),
+            'Most Novel Changed': bool(np.argmax(full_scores) != np.argmax(reduced_scores))}
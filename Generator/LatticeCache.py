@@ -0,0 +1,86 @@
+import hashlib
+from collections import OrderedDict
+
+from Generator.Delenox_Config import latent_precision
+from Generator.LatentPrecision import quantize, dequantize
+
+
+def genome_fingerprint(genome):
+    """
+    Hash every part of a CPPN genome that influences the lattice it renders: the activation, aggregation, bias
+    and response of each node and the weight of each enabled connection.  Genome keys and disabled genes are
+    ignored, so an unmutated survivor or a copy of an elite hashes to the same value in every generation.
+    :param genome: CPPN-NEAT genome.
+    :return: hexadecimal digest identifying the genome's network.
+    """
+    nodes = sorted((key, node.activation, node.aggregation, repr(node.bias), repr(node.response))
+                   for key, node in genome.nodes.items())
+    connections = sorted((key, repr(connection.weight)) for key, connection in genome.connections.items()
+                         if connection.enabled)
+    return hashlib.sha1(repr((nodes, connections)).encode()).hexdigest()
+
+
+class LatticeCache:
+    """
+    Bounded least-recently-used cache of the repaired lattices, feasibility flags and latent vectors of genomes,
+    keyed by their fingerprint.  Lattices do not depend on the auto-encoder and remain valid for the whole run,
+    whereas latent vectors are tagged with the version of the encoder that produced them and are discarded as
+    soon as a different encoder is in use.  Latent vectors are stored at the given precision.
+    """
+    def __init__(self, capacity, precision=latent_precision):
+        self.capacity = capacity
+        self.precision = precision
+        self.encoder_version = None
+        self.entries = OrderedDict()
+
+    def set_encoder_version(self, version):
+        """
+        Record the encoder currently used to compress lattices, invalidating latent vectors from other encoders.
+        :param version: identifier of the loaded encoder.
+        """
+        if version != self.encoder_version:
+            self.encoder_version = version
+            for entry in self.entries.values():
+                entry['Latent'] = None
+                entry['Version'] = None
+
+    def get(self, key):
+        """
+        :param key: fingerprint of the genome.
+        :return: the cached (lattice, feasibility) pair, or None if the genome has not been seen.
+        """
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]['Lattice'], self.entries[key]['Feasible']
+
+    def get_latent(self, key):
+        """
+        :param key: fingerprint of the genome.
+        :return: the cached latent vector computed by the current encoder, or None.
+        """
+        if key not in self.entries or self.entries[key]['Version'] != self.encoder_version:
+            return None
+        return dequantize(*self.entries[key]['Latent'])
+
+    def put(self, key, lattice, feasible):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = {'Lattice': lattice, 'Feasible': feasible, 'Latent': None, 'Version': None}
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def put_latent(self, key, latent):
+        if key in self.entries:
+            self.entries[key]['Latent'] = quantize(latent, self.precision)
+            self.entries[key]['Version'] = self.encoder_version
+
+    def clear(self):
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,74 @@
+import hashlib
+
+import numpy as np
+
+from Generator.Delenox_Config import lattice_dimensions
+
+
+def lattice_symmetries(lattice):
+    """
+    Transformations of a building which leave it the same building: mirrors and 90 degree rotations about the
+    vertical (third) axis.  Rotations by 90 degrees are only included when the lattice's footprint is square.
+    :param lattice: lattice of integer material codes.
+    :return: list of the transformed lattices, including the lattice itself.
+    """
+    rotations = range(4) if lattice.shape[0] == lattice.shape[1] else range(0, 4, 2)
+    transformed = []
+    for turns in rotations:
+        rotated = np.rot90(lattice, turns, axes=(0, 1))
+        transformed += [rotated, rotated[::-1]]
+    return transformed
+
+
+def canonical_key(lattice):
+    """
+    Hash of a lattice's canonical form, the smallest of its symmetric variants, so that lattices which are
+    identical up to a mirror or rotation share the same key.
+    :param lattice: one-hot encoded lattice, or lattice of integer material codes.
+    :return: digest of the canonical form.
+    """
+    lattice = np.asarray(lattice)
+    if lattice.ndim > len(lattice_dimensions):
+        lattice = np.argmax(lattice, axis=-1)
+    codes = lattice.astype(np.uint8)
+    canonical = min(np.ascontiguousarray(variant).tobytes() for variant in lattice_symmetries(codes))
+    return hashlib.sha1(canonical).digest()
+
+
+class LatticeIndex:
+    """
+    Counts of the distinct buildings seen so far, keyed by canonical hash.  The same index can be used across
+    several calls to deduplicate, e.g. to drop buildings which an earlier phase or run already contributed.
+    """
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, lattice):
+        """
+        :param lattice: lattice to record.
+        :return: the lattice's canonical key, and True if no symmetric variant of it had been seen before.
+        """
+        key = canonical_key(lattice)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return key, self.counts[key] == 1
+
+    def __len__(self):
+        return len(self.counts)
+
+
+def deduplicate(lattices, index=None):
+    """
+    Keep the first copy of every building, treating mirrored and rotated buildings as copies.
+    :param lattices: sequence of lattices.
+    :param index: LatticeIndex of the buildings already seen, which is updated, or None for a new index.
+    :return: list of the kept lattices, and the array of the number of copies of each of them.
+    """
+    index = LatticeIndex() if index is None else index
+    kept = []
+    keys = []
+    for lattice in lattices:
+        key, new = index.add(lattice)
+        if new:
+            kept.append(lattice)
+            keys.append(key)
+    return kept, np.asarray([index.counts[key] for key in keys])
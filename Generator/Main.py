@@ -1,6 +1,9 @@
-from Generator.Autoencoder import auto_encoder_3d, create_auto_encoder, add_noise_parallel
+from Generator.Autoencoder import auto_encoder_3d, create_auto_encoder, add_noise_batch, reconstruction_error
 from Generator.Delenox_Config import *
+from Generator.InferenceServer import InferenceServer
+from Generator.LatticeDedup import LatticeIndex, deduplicate
 from Generator.NeatGenerator import NeatGenerator
+from Generator.TrainingShards import TrainingShards, extract_shard
 
 if __name__ == '__main__':
 
@@ -19,6 +22,9 @@ if __name__ == '__main__':
     else:
         print("Experiment output directory already exists, resuming experiment...")
 
+    # A single inference process can serve the encoder to every NEAT run of the experiment.
+    server = InferenceServer() if inference_server else None
+
     for phase in range(number_of_phases):
 
         if not os.path.exists('Results/{}/Phase{:d}'.format(experiment, phase)):
@@ -43,6 +49,13 @@ if __name__ == '__main__':
                                 'Minimum Species Size': [], 'Maximum Species Size': [], 'Mean Species Size': []}
                 training_population = []
 
+        # Buildings already in this phase's training set, so the runs do not contribute copies of each other's
+        # archived lattices.  Copies are kept when they are counted as sample weights.
+        training_index = LatticeIndex()
+        if deduplicate_training:
+            for lattice in training_population:
+                training_index.add(lattice)
+
         neat_generators = []
         if phase == 0:
             for runs in range(runs_per_phase):
@@ -62,7 +75,9 @@ if __name__ == '__main__':
                 continue
 
             generator, best_fit, metrics = neat_generators[number].run_neat(phase, experiment, static, noise=noisy,
-                                                                            train_on_archive=train_on_archive)
+                                                                            train_on_archive=train_on_archive,
+                                                                            inference_server=server,
+                                                                            lattice_index=training_index)
             training_population += list(best_fit)
 
             # Save the neat populations to pickle files in the current phase folder
@@ -97,25 +112,76 @@ if __name__ == '__main__':
             else:
                 start = 0
 
-            for rewind in range(start, phase + 1):
-                training_history += list(
-                    np.load("./Results/{}/Phase{:d}/Training_Set.npz".format(experiment, rewind))[
-                        'arr_0'])
-
-            if noisy:
-                noisy_population = add_noise_parallel(np.asarray(training_history))
+            if not warm_start or random_ae:
+                previous = None
+            elif phase > 0:
+                previous = ("./Results/{}/Phase{:d}/encoder".format(experiment, phase - 1),
+                            "./Results/{}/Phase{:d}/decoder".format(experiment, phase - 1))
+            elif noisy:
+                previous = ("./Results/Seed/encoder_noisy", "./Results/Seed/decoder_noisy")
             else:
-                noisy_population = None
-
-            if random_ae:
-                training_pop = None
+                previous = ("./Results/Seed/encoder", "./Results/Seed/decoder")
+
+            shard_paths = ["./Results/{}/Phase{:d}/Training_Set.npz".format(experiment, rewind)
+                           for rewind in range(start, phase + 1)]
+
+            training_time = time.time()
+            # Replaying a bounded sample of the previous phases' lattices requires streaming them from their shards
+            replay = replay_capacity if full_history else None
+            if (streaming_training or replay is not None) and not random_ae:
+                shards = TrainingShards(shard_paths, replay=replay, unique=deduplicate_training,
+                                        weighted=duplicate_weights)
+                neat_metrics.update({'Training Set Size': len(shards)})
+                ae, encoder, decoder = create_auto_encoder(model_type=auto_encoder_3d,
+                                                           phase=phase,
+                                                           experiment=experiment,
+                                                           shards=shards,
+                                                           noise=add_noise_batch if noisy else None,
+                                                           previous=previous
+                                                           )
             else:
-                training_pop = np.asarray(training_history)
-
-            ae, encoder, decoder = create_auto_encoder(model_type=auto_encoder_3d,
-                                                       phase=phase,
-                                                       experiment=experiment,
-                                                       population=training_pop,
-                                                       noisy=noisy_population
-                                                       )
+                for path in shard_paths:
+                    training_history += list(np.load(path)['arr_0'])
+
+                counts = None
+                if deduplicate_training:
+                    training_history, counts = deduplicate(training_history)
+                    neat_metrics.update({'Training Set Size': len(training_history)})
+
+                if random_ae:
+                    training_pop = None
+                else:
+                    training_pop = np.asarray(training_history)
+
+                ae, encoder, decoder = create_auto_encoder(model_type=auto_encoder_3d,
+                                                           phase=phase,
+                                                           experiment=experiment,
+                                                           population=training_pop,
+                                                           noise=add_noise_batch if noisy else None,
+                                                           previous=previous,
+                                                           weights=counts if duplicate_weights else None
+                                                           )
+            training_time = time.time() - training_time
+
+            # Record the cost of this phase's transformation alongside the accuracy the auto-encoder reached
+            if getattr(ae, 'history', None) is not None:
+                neat_metrics.update({'Training Epochs': len(ae.history.epoch), 'Training Time': training_time,
+                                     'Validation Accuracy': max(ae.history.history['val_categorical_accuracy'])})
+                np.savez_compressed("./Results/{}/Phase{:d}/Metrics.npz".format(experiment, phase), neat_metrics)
+                print("[Phase {:d}]: Trained the auto-encoder for {:d} epochs in {:.2f} seconds.".format(
+                    phase, len(ae.history.epoch), training_time))
+
+            # Check how well the auto-encoder still reconstructs the lattices of every phase so far, so replaying
+            # a sample of the history can be compared with retraining on all of it
+            if replay_report:
+                neat_metrics.update({'History Reconstruction Error': [
+                    reconstruction_error(encoder, decoder, extract_shard(
+                        "./Results/{}/Phase{:d}/Training_Set.npz".format(experiment, rewind)))
+                    for rewind in range(phase + 1)]})
+                np.savez_compressed("./Results/{}/Phase{:d}/Metrics.npz".format(experiment, phase), neat_metrics)
+                print("[Phase {:d}]: Reconstruction error on each phase's training set: {}".format(
+                    phase, neat_metrics['History Reconstruction Error']))
         plt.close('all')
+
+    if server is not None:
+        server.stop()
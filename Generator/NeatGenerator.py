@@ -1,10 +1,24 @@
 # from conda import iteritems
+import multiprocessing
 
-from Generator.Autoencoder import add_noise, convert_to_integer, load_model, create_auto_encoder, auto_encoder_3d
+from Generator.Autoencoder import add_noise, convert_to_integer, load_model, create_auto_encoder, auto_encoder_3d, \
+    encode_lattices, inference_function
 from Generator.Constraints import *
+from Generator.CPPN import CompiledCPPN, render_lattice, render_lattices, render_lattice_per_voxel
+from Generator.LatticeCache import LatticeCache, genome_fingerprint
+from Generator.NeighbourIndex import BruteForceIndex, exact_distances, nearest
+from Generator.NoveltyArchive import NoveltyArchive
+from Generator.LatentPrecision import round_trip, precision_report
+from Generator.NoveltyProjection import NoveltyProjection
+from Generator.InferenceServer import EncoderClient
+from Generator.LatticeDedup import deduplicate
+from scipy.stats import spearmanr
 from Generator.Delenox_Config import *
 from Generator.Visualization import *
 
+# Encoder of the current phase inside each pool worker when fused_workers is enabled, see load_worker_encoder.
+worker_encoder = None
+
 
 class NeatGenerator:
     """
@@ -23,28 +37,49 @@ class NeatGenerator:
         self.current_phase = 0
         self.current_gen = 0
         self.encoder = None
+        self.encode = None
         self.decoder = None
         self.pool = None
         self.noise = False
-        self.archive = []
+        self.archive = NoveltyArchive()
+        # Unbounded copy of the archive, only kept to measure how far a bounded archive shifts novelty scores.
+        self.unbounded_archive = None
+        if archive_capacity is not None and archive_shift_report:
+            self.unbounded_archive = NoveltyArchive(capacity=None)
+        # Full precision copy of the archive, only kept to measure how reduced precision latents change novelty.
+        self.full_precision_archive = None
+        if latent_precision != 'float32' and latent_precision_report:
+            self.full_precision_archive = NoveltyArchive(capacity=None, precision='float32')
+        self.projection = NoveltyProjection() if novelty_projection is not None else None
         self.phase_best_fit = []
-        self.archive_lattices = []
+        self.lattice_cache = LatticeCache(lattice_cache_size,
+                                          'float32' if self.full_precision_archive is not None else latent_precision)
         self.neat_metrics = {'Experiment': None, 'Mean Novelty': [], 'Best Novelty': [], 'Node Complexity': [],
-                             'Infeasible Size': [], 'Connection Complexity': [], 'Archive Size': [],
+                             'Infeasible Size': [], 'Connection Complexity': [], 'Archive Size': [], 'Cache Hits': [],
+                             'Renders Saved': [], 'Rejections': [], 'Stage Timings': [], 'Archive Evictions': [],
+                             'Archive Novelty Shift': [], 'Archive Encoding Time': [], 'Latent Precision Changes': [],
+                             'Projection Rank Correlation': [],
                              'Species Count': [], 'Mean Genetic Diversity': [],
                              'Minimum Species Size': [], 'Maximum Species Size': [], 'Mean Species Size': []}
 
-    def run_neat(self, phase_number, p_experiment, static=False, noise=False, persistent_archive=True, train_on_archive=True):
+    def run_neat(self, phase_number, p_experiment, static=False, noise=False, persistent_archive=True, train_on_archive=True,
+                 inference_server=None, lattice_index=None):
         """
         Executes one "exploration" phase of the Delenox pipeline.  A set number of independent evolutionary runs
         are completed and the top N most novel individuals are taken and inserted into a population.  At the of
         the phase we look at the distribution of individuals in the population according to numerous metrics and
-        statistics regarding the evolution of the populations such as the speciation, novelty scores etc.
+        statistics regarding the evolution of the populations such as the speciation, novelty scores etc.  If an
+        InferenceServer is given, lattices are encoded by the server's process instead of a local copy of the encoder.
+        When deduplicating training sets, the archived lattices returned for training exclude buildings already
+        recorded in the given LatticeIndex, which is shared by every run of the phase.
         """
         # Check to see if we should clear the novelty archive before starting the next phase.
         if not persistent_archive:
-            self.archive = []
-            self.archive_lattices.clear()
+            self.archive.clear()
+            if self.unbounded_archive is not None:
+                self.unbounded_archive.clear()
+            if self.full_precision_archive is not None:
+                self.full_precision_archive.clear()
 
         if phase_number == 0:
             self.config = load_config_file()
@@ -59,26 +94,46 @@ class NeatGenerator:
 
         # Load last phase's autoencoder, or the seed autoencoder if this is the first phase.
         if phase_number > 0 and static is False:
-            self.encoder = load_model(
-                "./Results/{}/Phase{:d}/encoder".format(p_experiment, phase_number - 1))
+            encoder_path = "./Results/{}/Phase{:d}/encoder".format(p_experiment, phase_number - 1)
             self.decoder = load_model(
                 "./Results/{}/Phase{:d}/decoder".format(p_experiment, phase_number - 1))
         else:
             # If the experiment uses a de-noising autoencoder, load the appropriate model.
             if not noise:
-                self.encoder = load_model("./Results/Seed/encoder")
+                encoder_path = "./Results/Seed/encoder"
                 self.decoder = load_model("./Results/Seed/decoder")
             else:
-                self.encoder = load_model("./Results/Seed/encoder_noisy")
+                encoder_path = "./Results/Seed/encoder_noisy"
                 self.decoder = load_model("./Results/Seed/decoder_noisy")
+        if inference_server is None:
+            self.encoder = load_model(encoder_path)
+            self.encode = inference_function(self.encoder)
+        else:
+            self.encoder = inference_server.connect(encoder_path)
+            self.encode = self.encoder.encode
+        self.lattice_cache.set_encoder_version(encoder_path)
 
         # Update the archive of latent vectors with the current encoder's interpretation of the lattices
-        self.archive = []
-        for lattice in self.archive_lattices:
-            self.archive.append(self.encoder.predict(lattice[None])[0])
+        start = time.time()
+        self.archive.reencode(encode_lattices(self.encoder, self.archive.archived_lattices()))
+        if self.unbounded_archive is not None:
+            self.unbounded_archive.reencode(encode_lattices(self.encoder,
+                                                            self.unbounded_archive.archived_lattices()))
+        if self.full_precision_archive is not None:
+            self.full_precision_archive.reencode(encode_lattices(self.encoder,
+                                                                 self.full_precision_archive.archived_lattices()))
+        self.neat_metrics['Archive Encoding Time'].append(time.time() - start)
+        print("[Population {:d}]: Re-encoding {:d} archived lattices took {:2f} seconds.".format(
+            self.population_id, len(self.archive), time.time() - start))
 
         # Initialize the processes used for the NEAT run and execute the phase.
-        self.pool = Pool(thread_count)
+        if fused_workers:
+            # The workers load their own encoder, which is not safe in processes forked from one that already
+            # initialised TensorFlow, so they are spawned instead.
+            self.pool = multiprocessing.get_context('spawn').Pool(thread_count, initializer=load_worker_encoder,
+                                                                  initargs=(encoder_path,))
+        else:
+            self.pool = Pool(thread_count)
         self.population.run(self.run_one_generation, generations_per_run)
         self.pool.close()
         self.pool.join()
@@ -89,12 +144,18 @@ class NeatGenerator:
         self.neat_metrics['Best Novelty'] = self.population.reporters.reporters[0].get_fitness_stat(max)
 
         # Clearing the pool variable and auto-encoder as these cannot be saved to a pickle file.
+        if inference_server is not None:
+            inference_server.disconnect(self.encoder)
         self.pool = None
         self.encoder = None
+        self.encode = None
         self.decoder = None
+        self.lattice_cache.clear()
 
-        if train_on_archive:
-            return self, self.archive_lattices, self.neat_metrics
+        if train_on_archive and deduplicate_training and not duplicate_weights:
+            return self, deduplicate(self.archive.archived_lattices(), lattice_index)[0], self.neat_metrics
+        elif train_on_archive:
+            return self, self.archive.archived_lattices(), self.neat_metrics
         else:
             return self, self.phase_best_fit, self.neat_metrics
 
@@ -107,14 +168,61 @@ class NeatGenerator:
         """
         start = time.time()
         compressed_population = {}
+        full_population = {}
         lattices = {}
         remove = 0
         jobs = []
 
+        # Only render the genomes whose network has not been seen recently, re-using the cached results otherwise.
+        fingerprints = {genome_id: genome_fingerprint(genome) for genome_id, genome in genomes}
+        results = {}
+        to_render = []
+        for genome_id, genome in genomes:
+            cached = self.lattice_cache.get(fingerprints[genome_id])
+            if cached is None:
+                to_render.append((genome_id, genome))
+            else:
+                results.update({genome_id: cached})
+        cache_hits = len(results)
+
+        for batch in range(0, len(to_render), render_batch_size):
+            batch_genomes = [genome for _, genome in to_render[batch:batch + render_batch_size]]
+            if fused_workers:
+                jobs.append(self.pool.apply_async(generate_and_encode_batch, (batch_genomes, config, self.noise)))
+            else:
+                jobs.append(self.pool.apply_async(generate_lattice_batch, (batch_genomes, config, False)))
+        rendered = []
+        statistics = {'Renders Saved': 0, 'Rejections': {}, 'Timings': {}}
+        submitted = {}
+        worker_latents = {}
+        for job in jobs:
+            batch_results, batch_statistics = job.get()
+            batch_ids = [genome_id for genome_id, _ in to_render[len(rendered):len(rendered) + len(batch_results)]]
+            # Fused workers return compact lattices with their latent vectors, which are expanded here.
+            if fused_workers:
+                worker_latents.update({genome_id: latent for genome_id, (_, latent, feasible) in
+                                       zip(batch_ids, batch_results) if feasible})
+                batch_results = [(expand_lattice(compact) if feasible else None, None, feasible)
+                                 for compact, _, feasible in batch_results]
+            # With an inference server, feasible lattices are sent for encoding while later batches are rendered.
+            elif isinstance(self.encoder, EncoderClient) and not self.noise:
+                feasible = [(genome_id, lattice) for genome_id, (lattice, _, flag) in zip(batch_ids, batch_results)
+                            if flag]
+                if feasible:
+                    request = self.encoder.submit([lattice for _, lattice in feasible])
+                    submitted.update({genome_id: (request, position) for position, (genome_id, _) in
+                                      enumerate(feasible)})
+            rendered += batch_results
+            statistics['Renders Saved'] += batch_statistics['Renders Saved']
+            for key in ['Rejections', 'Timings']:
+                for stage, value in batch_statistics[key].items():
+                    statistics[key][stage] = statistics[key].get(stage, 0) + value
+        for (lattice, _, feasible), (genome_id, genome) in zip(rendered, to_render):
+            results.update({genome_id: (lattice, feasible)})
+            self.lattice_cache.put(fingerprints[genome_id], lattice, feasible)
+
         for genome_id, genome in genomes:
-            jobs.append(self.pool.apply_async(generate_lattice, (genome, config, False, None)))
-        for job, (genome_id, genome) in zip(jobs, genomes):
-            lattice, _, feasible = job.get()
+            lattice, feasible = results[genome_id]
             if not feasible:
                 del self.population.population[genome_id]
                 genome.fitness = 0
@@ -122,29 +230,78 @@ class NeatGenerator:
             else:
                 lattices.update({genome_id: lattice})
 
+        to_compress = []
+        responses = {}
         for genome_id, lattice in lattices.items():
-            to_compress = lattice
-            if self.noise:
-                to_compress = add_noise(lattice)
-            compressed_population.update({genome_id: self.encoder.predict(to_compress[None])[0]})
-
-        jobs.clear()
-        for genome_id in compressed_population.keys():
-            parameters = (compressed_population[genome_id], compressed_population, self.archive)
-            jobs.append(self.pool.apply_async(novelty_search, parameters))
-        for job, genome_id in zip(jobs, compressed_population.keys()):
-            self.population.population[genome_id].fitness = job.get()
+            # Latent vectors of de-noising experiments depend on the noise drawn, so those are never re-used.
+            latent = None if self.noise else self.lattice_cache.get_latent(fingerprints[genome_id])
+            if latent is not None:
+                full_population.update({genome_id: latent})
+            elif genome_id in worker_latents:
+                full_population.update({genome_id: worker_latents[genome_id]})
+                if not self.noise:
+                    self.lattice_cache.put_latent(fingerprints[genome_id], worker_latents[genome_id])
+            elif genome_id in submitted:
+                request, position = submitted[genome_id]
+                if request not in responses:
+                    responses[request] = self.encoder.result(request)
+                full_population.update({genome_id: responses[request][position]})
+                self.lattice_cache.put_latent(fingerprints[genome_id], responses[request][position])
+            else:
+                to_compress.append(genome_id)
+
+        # Every lattice without a cached latent vector is compressed by a single call to the encoder.
+        if to_compress:
+            batch = np.asarray([add_noise(lattices[genome_id]) if self.noise else lattices[genome_id]
+                                for genome_id in to_compress])
+            for genome_id, latent in zip(to_compress, self.encode(batch)):
+                full_population.update({genome_id: latent})
+                if not self.noise:
+                    self.lattice_cache.put_latent(fingerprints[genome_id], latent)
+
+        full_population = {genome_id: full_population[genome_id] for genome_id in lattices.keys()}
+        for genome_id, latent in full_population.items():
+            # Score the population at the same precision as the archive.
+            compressed_population.update({genome_id: round_trip(latent)})
+
+        if self.full_precision_archive is not None:
+            self.neat_metrics['Latent Precision Changes'].append(
+                precision_report(list(full_population.values()), self.full_precision_archive.as_array()))
+        if self.projection is None:
+            scores = novelty_scores(list(compressed_population.values()), self.archive)
+        else:
+            population = np.asarray(list(compressed_population.values()))
+            if self.current_gen == 0 or (projection_refit > 0 and self.current_gen % projection_refit == 0):
+                self.projection.fit(np.concatenate([self.archive.dequantized(), population])
+                                    if len(self.archive) > 0 else population)
+            scores = projected_novelty_scores(population, self.archive, self.projection)
+            if projection_report:
+                self.neat_metrics['Projection Rank Correlation'].append(
+                    round(float(spearmanr(scores, novelty_scores(population, self.archive))[0]), 3))
+        for genome_id, score in zip(compressed_population.keys(), scores):
+            self.population.population[genome_id].fitness = score
+        if self.unbounded_archive is not None:
+            unbounded_scores = novelty_scores(list(compressed_population.values()), self.unbounded_archive)
+            self.neat_metrics['Archive Novelty Shift'].append(novelty_shift(scores, unbounded_scores))
 
         fitness = {genome_id: fitness.fitness for genome_id, fitness in self.population.population.items() if
                    fitness.fitness > 0}
         sorted_keys = [k for k, _ in sorted(fitness.items(), key=lambda item: item[1])]
 
-        for individual in range(1, np.min([add_to_archive, len(lattices)])):
-            lattice = lattices[sorted_keys[-individual]]
-            self.archive_lattices.append(lattice)
-            vector = self.encoder.predict(lattice[None])[0]
-            if len(self.archive) == 0 or not (vector == self.archive).all(1).any():
-                self.archive.append(vector)
+        archived = [sorted_keys[-individual] for individual in range(1, np.min([add_to_archive, len(lattices)]))]
+        # The latent vectors of de-noising experiments were computed from noisy lattices, so the clean lattices are
+        # encoded for the archive in a single call; otherwise the generation's latent vectors are re-used.
+        if self.noise and archived:
+            vectors = self.encode(np.asarray([lattices[genome_id] for genome_id in archived]))
+        else:
+            vectors = [full_population[genome_id] for genome_id in archived]
+        for genome_id, vector in zip(archived, vectors):
+            lattice = lattices[genome_id]
+            self.archive.add(vector, fitness[genome_id], self.current_phase, lattice)
+            if self.unbounded_archive is not None:
+                self.unbounded_archive.add(vector, fitness[genome_id], self.current_phase, lattice)
+            if self.full_precision_archive is not None:
+                self.full_precision_archive.add(vector, fitness[genome_id], self.current_phase, lattice)
 
         if self.current_gen % 100 == 0 or self.current_gen + 1 == generations_per_run:
             most_novel_lattice = lattices[sorted_keys[-1]]
@@ -173,8 +330,13 @@ class NeatGenerator:
         self.neat_metrics['Node Complexity'].append(node_complexity)
         self.neat_metrics['Connection Complexity'].append(connection_complexity)
         self.neat_metrics['Archive Size'].append(len(self.archive))
+        self.neat_metrics['Archive Evictions'].append(self.archive.evicted)
         self.neat_metrics['Species Count'].append(len(self.population.species.species))
         self.neat_metrics['Infeasible Size'].append(remove)
+        self.neat_metrics['Cache Hits'].append(cache_hits)
+        self.neat_metrics['Renders Saved'].append(statistics['Renders Saved'])
+        self.neat_metrics['Rejections'].append(statistics['Rejections'])
+        self.neat_metrics['Stage Timings'].append(statistics['Timings'])
         self.neat_metrics['Minimum Species Size'].append(np.min(species_sizes))
         self.neat_metrics['Maximum Species Size'].append(np.max(species_sizes))
         self.neat_metrics['Mean Species Size'].append(np.mean(species_sizes))
@@ -183,7 +345,18 @@ class NeatGenerator:
         print("Average Hidden Layer Size: {:2.2f}".format(node_complexity))
         print("Average Connection Count: {:2.2f}".format(connection_complexity))
         print("Size of the Novelty Archive: {:d}".format(len(self.archive)))
+        if self.unbounded_archive is not None:
+            print("Novelty Shift from Bounding the Archive:", self.neat_metrics['Archive Novelty Shift'][-1])
+        if self.projection is not None and projection_report:
+            print("Rank Correlation of Projected Novelty:", self.neat_metrics['Projection Rank Correlation'][-1])
+        if self.full_precision_archive is not None:
+            print("Novelty Changes from Reduced Precision:", self.neat_metrics['Latent Precision Changes'][-1])
         print("Number of Infeasible Buildings:", remove)
+        print("Lattice Cache Hits:", cache_hits)
+        print("Full Renders Saved by Pre-Screen:", statistics['Renders Saved'])
+        print("Rejections per Constraint:", statistics['Rejections'])
+        print("Worker Seconds per Stage:",
+              {stage: round(seconds, 2) for stage, seconds in statistics['Timings'].items()})
         print("Number of Species:", len(self.population.species.species))
         print("Species Sizes:", species_sizes)
         print("Max Novelty:", fitness[sorted_keys[-1]])
@@ -220,6 +393,65 @@ def novelty_search(genome, compressed_population, archive):
     return np.round(np.average(distances[:k_nearest_neighbors]), 2)
 
 
+def novelty_scores(population, archive):
+    """
+    Computes the novelty score of every individual of the generation at once, from the matrix of pairwise
+    distances to the rest of the population and the k nearest neighbours found in the archive's index.
+    Distances are accumulated element by element in the latent vectors' own precision and the k nearest
+    neighbours are found with a partial sort, so each score is identical to the one given by novelty_search,
+    including the exclusion of identical vectors.
+    :param population: latent vectors of the current generation.
+    :param archive: the novelty archive or nearest neighbour index, or a list of past novel individuals.
+    :return: list of novelty scores, in the same order as the population.
+    """
+    if len(population) == 0:
+        return []
+    population = np.asarray(population)
+    if not hasattr(archive, 'query'):
+        vectors = np.asarray(archive, dtype=population.dtype).reshape(-1, population.shape[1])
+        archive = BruteForceIndex()
+        archive.rebuild(vectors)
+
+    distances, identical = exact_distances(population[:, None, :], population[None, :, :])
+    distances = np.concatenate([nearest(distances, identical, k_nearest_neighbors),
+                                archive.query(population, k_nearest_neighbors)], axis=1)
+    scores = []
+    for row in nearest(distances, np.zeros(distances.shape, dtype=bool), k_nearest_neighbors):
+        scores.append(np.round(np.average(row[np.isfinite(row)]), 2))
+    return scores
+
+
+def projected_novelty_scores(population, archive, projection):
+    """
+    Computes the novelty scores of a generation in the lower dimensional space of the given projection.
+    Members of the population with a copy in the archive are given exactly the same projection as that copy, so
+    they are still recognised as identical and excluded from each other's neighbours.
+    :param population: latent vectors of the current generation, at the archive's precision.
+    :param archive: the novelty archive.
+    :param projection: fitted NoveltyProjection.
+    :return: list of novelty scores, in the same order as the population.
+    """
+    projected_population = projection.transform(population)
+    projected_archive = projection.project_archive(archive)
+    rows = archive.find(population)
+    projected_population[rows >= 0] = projected_archive.vectors[rows[rows >= 0]]
+    return novelty_scores(list(projected_population), projected_archive)
+
+
+def novelty_shift(scores, reference_scores):
+    """
+    Measure how far the novelty scores given by a bounded archive are from those given by an unbounded one.
+    :param scores: novelty scores of the generation against the bounded archive.
+    :param reference_scores: novelty scores of the same generation against the unbounded archive.
+    :return: dictionary of the mean and maximum absolute shift and the rank correlation of the two scorings.
+    """
+    scores = np.asarray(scores)
+    reference_scores = np.asarray(reference_scores)
+    shift = np.abs(scores - reference_scores)
+    return {'Mean Shift': round(float(np.mean(shift)), 3), 'Max Shift': round(float(np.max(shift)), 3),
+            'Rank Correlation': round(float(spearmanr(scores, reference_scores)[0]), 3)}
+
+
 def generate_lattice(genome, config, noise_flag=True, plot=None):
     """
     Generates a lattice using the given CPPN genome and NEAT configuration file.  May also generate
@@ -230,14 +462,126 @@ def generate_lattice(genome, config, noise_flag=True, plot=None):
     :param config: CPPN-NEAT config file specifying the parameters for the genomes.
     :return: generated lattice, noisy variant, feasibility status and
     """
-    net = neat.nn.FeedForwardNetwork.create(genome, config)
-    lattice = np.zeros(lattice_dimensions)
-    noisy = np.zeros(lattice_dimensions)
+    if vectorized_rendering:
+        if ground_prescreen and not entrance_possible(CompiledCPPN(genome, config).render(height=door_height)):
+            return infeasible_lattice()
+        lattice = render_lattice(genome, config)
+    else:
+        lattice = render_lattice_per_voxel(genome, config)
+    return process_lattice(lattice, noise_flag, plot)
+
+
+def generate_lattice_batch(genomes, config, noise_flag=True):
+    """
+    Generates the lattices of a batch of CPPN genomes in a single call, so that one pool task returns the
+    results of many genomes.  Genomes sharing a network topology are rendered together as one tensor program.
+    :param genomes: CPPN objects used to generate lattices.
+    :param config: CPPN-NEAT config file specifying the parameters for the genomes.
+    :param noise_flag: Boolean value for adding noise.
+    :return: list of (lattice, noisy variant, feasibility status) tuples in the same order as the genomes, and
+    the batch's statistics: the number of full renders saved by the pre-screen, the number of rejections per
+    constraint and the seconds spent in each stage of the pipeline.
+    """
+    statistics = {'Renders Saved': 0, 'Rejections': {}, 'Timings': {}}
+    start = time.time()
+
+    candidates = list(range(len(genomes)))
+    if vectorized_rendering and ground_prescreen:
+        ground_layers = render_lattices(genomes, config, height=door_height)
+        candidates = [index for index in candidates if entrance_possible(ground_layers[index])]
+        statistics['Renders Saved'] = len(genomes) - len(candidates)
+        statistics['Rejections']['Pre-Screen'] = len(genomes) - len(candidates)
+        start = record_stage(statistics['Timings'], 'Pre-Screen', start)
+
+    results = [infeasible_lattice()] * len(genomes)
+    if candidates:
+        if vectorized_rendering:
+            lattices = render_lattices([genomes[index] for index in candidates], config)
+        else:
+            lattices = [render_lattice_per_voxel(genomes[index], config) for index in candidates]
+        record_stage(statistics['Timings'], 'Render', start)
+
+        lattices, feasible, reasons = apply_constraints_batch(np.asarray(lattices), statistics['Timings'])
+        for reason in reasons[np.not_equal(reasons, None)]:
+            statistics['Rejections'][reason] = statistics['Rejections'].get(reason, 0) + 1
 
-    for (x, y, z) in value_range:
-        lattice[x][y][z] = np.round(
-            net.activate((x / lattice_dimensions[0], y / lattice_dimensions[0], z / lattice_dimensions[0]))[0])
+        start = time.time()
+        for index, lattice, valid in zip(candidates, lattices, feasible):
+            results[index] = encode_lattice(lattice, bool(valid), noise_flag)
+        record_stage(statistics['Timings'], 'One-Hot', start)
+    return results, statistics
+
+
+def load_worker_encoder(encoder_path):
+    """
+    Pool initializer of the fused worker mode, loading the phase's encoder once in each worker process.
+    :param encoder_path: path of the encoder used in the current phase.
+    """
+    global worker_encoder
+    worker_encoder = inference_function(load_model(encoder_path), render_batch_size)
+
+
+def generate_and_encode_batch(genomes, config, noise_flag=False):
+    """
+    Fused worker task which generates, repairs and encodes a batch of CPPN genomes with the encoder loaded by
+    load_worker_encoder, returning only what the coordinating process needs instead of full one-hot lattices.
+    :param genomes: CPPN objects used to generate lattices.
+    :param config: CPPN-NEAT config file specifying the parameters for the genomes.
+    :param noise_flag: Boolean value for encoding a noisy variant of each lattice instead of the lattice itself.
+    :return: list of (compact lattice, latent vector, feasibility status) tuples in the same order as the
+    genomes, where compact lattices hold the material index of each voxel and infeasible genomes have no
+    lattice or latent vector, and the batch's statistics as given by generate_lattice_batch.
+    """
+    results, statistics = generate_lattice_batch(genomes, config, False)
+    feasible = [index for index, (_, _, valid) in enumerate(results) if valid]
+    compressed = {}
+    if feasible:
+        start = time.time()
+        lattices = [add_noise(results[index][0]) if noise_flag else results[index][0] for index in feasible]
+        compressed = dict(zip(feasible, worker_encoder(np.asarray(lattices))))
+        record_stage(statistics['Timings'], 'Encode', start)
+    return [(np.argmax(lattice, axis=-1).astype(np.uint8), compressed[index], True) if index in compressed
+            else (None, None, False) for index, (lattice, _, _) in enumerate(results)], statistics
+
+
+def expand_lattice(compact):
+    """
+    :param compact: lattice holding the material index of each voxel.
+    :return: the one-hot encoded lattice.
+    """
+    return np.eye(5, dtype=bool)[compact]
+
+
+def infeasible_lattice():
+    """
+    :return: the result reported for a genome rejected before its lattice was rendered in full.
+    """
+    empty = np.zeros(lattice_dimensions + (5,), dtype=bool)
+    return empty, empty, False
+
+
+def process_lattice(lattice, noise_flag=True, plot=None):
+    """
+    Repairs a rendered lattice with the pipeline's constraints and converts it to its one-hot representation.
+    :param lattice: lattice of rounded CPPN outputs.
+    :param noise_flag: Boolean value for adding noise.
+    :param plot: Title of the figure for the plot
+    :return: repaired lattice, noisy variant and feasibility status.
+    """
     feasible, lattice = apply_constraints(lattice)
+    return encode_lattice(lattice, feasible, noise_flag, plot)
+
+
+def encode_lattice(lattice, feasible, noise_flag=True, plot=None):
+    """
+    Converts a repaired lattice to its one-hot representation, along with a noisy variant if required.
+    :param lattice: repaired lattice.
+    :param feasible: feasibility status of the lattice.
+    :param noise_flag: Boolean value for adding noise.
+    :param plot: Title of the figure for the plot
+    :return: repaired lattice, noisy variant and feasibility status.
+    """
+    noisy = np.zeros(lattice_dimensions)
     if noise_flag:
         noisy = add_noise(lattice)
     if plot is not None:
@@ -254,10 +598,11 @@ def generate_lattices(genomes, config, noise_flag=True):
     jobs = []
     lattices = []
     noisy = []
-    for genome in genomes:
-        jobs.append(pool.apply_async(generate_lattice, (genome, config, noise_flag)))
-    for job in jobs:
-        lattice, noisy_lattice, valid = job.get()
+    genomes = list(genomes)
+    for batch in range(0, len(genomes), render_batch_size):
+        jobs.append(pool.apply_async(generate_lattice_batch, (genomes[batch:batch + render_batch_size], config,
+                                                              noise_flag)))
+    for lattice, noisy_lattice, valid in [result for job in jobs for result in job.get()[0]]:
         if valid:
             lattices.append(lattice)
             if noise_flag:
@@ -0,0 +1,247 @@
+import time
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from Generator.Delenox_Config import k_nearest_neighbors, compressed_length
+from Generator.LatentPrecision import dequantize, quantized_distances
+
+# Number of archive vectors compared to the whole generation at a time by the brute-force index
+block_size = 256
+
+
+def exact_distances(queries, neighbours):
+    """
+    Euclidean distances accumulated element by element in the vectors' own precision, which is how
+    novelty_search computes them.  Inputs are broadcast against each other on all but the last axis.
+    :param queries: array of latent vectors, e.g. of shape (N, 1, D).
+    :param neighbours: array of latent vectors, e.g. of shape (1, M, D).
+    :return: array of distances, and a boolean array marking pairs of identical vectors.
+    """
+    shape = np.broadcast_shapes(queries.shape[:-1], neighbours.shape[:-1])
+    distances = np.zeros(shape, dtype=np.result_type(queries, neighbours))
+    identical = np.ones(shape, dtype=bool)
+    for element in range(queries.shape[-1]):
+        distances += np.square(queries[..., element] - neighbours[..., element])
+        identical &= queries[..., element] == neighbours[..., element]
+    return np.sqrt(distances), identical
+
+
+def nearest(distances, identical, k):
+    """
+    :param distances: array of distances from each query (row) to its candidate neighbours.
+    :param identical: boolean array marking candidates identical to the query, which are never neighbours.
+    :param k: number of neighbours to keep.
+    :return: the k smallest distances of each row in ascending order, padded with infinity.
+    """
+    distances = np.where(identical, np.inf, distances)
+    count = min(k, distances.shape[1])
+    if count == 0:
+        return np.zeros((len(distances), 0), dtype=distances.dtype)
+    return np.sort(np.partition(distances, count - 1, axis=1)[:, :count], axis=1)
+
+
+class BruteForceIndex:
+    """
+    Nearest neighbour index which compares every query to every vector of the archive.  The index does not copy
+    the archive; it searches the matrix of latent vectors it was last given.  Full precision vectors are compared
+    exactly, whereas reduced precision vectors, given with their scales, are compared with quantized_distances.
+    """
+    def __init__(self):
+        self.vectors = np.zeros((0, compressed_length), dtype=np.float32)
+        self.scales = None
+
+    def update(self, vectors, scales=None):
+        """
+        Point the index at the archive's vectors after new ones were appended to it.
+        :param vectors: matrix of latent vectors of the archive, of which previously indexed vectors are a prefix.
+        :param scales: scales of the vectors if they are stored at a reduced precision, otherwise None.
+        """
+        self.vectors = vectors
+        self.scales = scales
+
+    def remove(self, vectors, scales, row):
+        """
+        Point the index at the archive's vectors after the vector at the given row was replaced by the last one.
+        :param vectors: matrix of latent vectors of the archive, one row shorter than before.
+        :param scales: scales of the vectors if they are stored at a reduced precision, otherwise None.
+        :param row: row whose vector changed.
+        """
+        self.vectors = vectors
+        self.scales = scales
+
+    def rebuild(self, vectors, scales=None):
+        """
+        Replace the contents of the index, e.g. when the archive is re-encoded by a new encoder.
+        :param vectors: matrix of latent vectors of the archive.
+        :param scales: scales of the vectors if they are stored at a reduced precision, otherwise None.
+        """
+        self.vectors = vectors
+        self.scales = scales
+
+    def distances(self, queries, rows):
+        """
+        :param queries: array of latent vectors of shape (N, D).
+        :param rows: indices of the archive vectors to compare to, of shape (1, M) or (N, M).
+        :return: array of distances of shape (N, M), and a boolean array marking vectors identical to the query.
+        """
+        if self.scales is None:
+            return exact_distances(queries[:, None, :], self.vectors[rows])
+        return quantized_distances(queries, self.vectors[rows], self.scales[rows])
+
+    def query(self, queries, k=k_nearest_neighbors):
+        """
+        Find the distances to the k nearest vectors of the index, ignoring vectors identical to the query.
+        :param queries: array of latent vectors of shape (N, D).
+        :param k: number of neighbours.
+        :return: array of shape (N, min(k, len(index))) of ascending distances, padded with infinity.
+        """
+        queries = np.asarray(queries)
+        if len(self.vectors) == 0:
+            return np.zeros((len(queries), 0), dtype=queries.dtype)
+        # The archive is scanned in blocks so the distance arrays stay small, keeping the k nearest of each block.
+        candidates = []
+        for block in range(0, len(self.vectors), block_size):
+            rows = np.arange(block, min(block + block_size, len(self.vectors)))[None]
+            candidates.append(nearest(*self.distances(queries, rows), k))
+        distances = np.concatenate(candidates, axis=1)
+        return nearest(distances, np.zeros(distances.shape, dtype=bool), k)
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+class BallTreeIndex(BruteForceIndex):
+    """
+    Nearest neighbour index backed by a ball tree.  New vectors are kept in a small buffer which is searched
+    exhaustively, and the tree is only rebuilt once the buffer grows past a fraction of the tree's size.  Rows of
+    the tree whose vector was since replaced or removed are marked stale: the tree's candidates at these rows are
+    ignored and the rows' current vectors are searched exhaustively along with the buffer.  The tree is used to
+    select candidate neighbours, whose distances are then recomputed exactly so that scores match the
+    brute-force index.
+    """
+    def __init__(self, leaf_size=40, rebuild_fraction=0.1):
+        super().__init__()
+        self.leaf_size = leaf_size
+        self.rebuild_fraction = rebuild_fraction
+        self.tree = None
+        self.tree_size = 0
+        self.stale = set()
+
+    def update(self, vectors, scales=None):
+        appended = range(len(self.vectors), len(vectors))
+        super().update(vectors, scales)
+        self.stale.update(row for row in appended if row < self.tree_size)
+        self.refresh()
+
+    def remove(self, vectors, scales, row):
+        last = len(self.vectors) - 1
+        super().remove(vectors, scales, row)
+        self.stale.update(changed for changed in (row, last) if changed < self.tree_size)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuild the tree once the rows searched exhaustively grow past a fraction of the tree's size.
+        """
+        outdated = len(self.stale) + max(0, len(self.vectors) - self.tree_size)
+        if outdated > max(k_nearest_neighbors, self.rebuild_fraction * self.tree_size):
+            self.build_tree()
+
+    def rebuild(self, vectors, scales=None):
+        super().rebuild(vectors, scales)
+        self.build_tree()
+
+    def build_tree(self):
+        self.stale.clear()
+        self.tree_size = len(self.vectors)
+        vectors = self.vectors if self.scales is None else dequantize(self.vectors, self.scales)
+        self.tree = BallTree(np.asarray(vectors, dtype=float), leaf_size=self.leaf_size) if self.tree_size > 0 else None
+
+    def query(self, queries, k=k_nearest_neighbors):
+        queries = np.asarray(queries)
+        if len(self.vectors) == 0:
+            return np.zeros((len(queries), 0), dtype=queries.dtype)
+
+        distances = [np.zeros((len(queries), 0), dtype=queries.dtype)]
+        if self.tree is not None:
+            distances.append(self.tree_query(queries, k))
+        pending = np.concatenate([np.array(sorted(row for row in self.stale if row < len(self.vectors)), dtype=int),
+                                  np.arange(self.tree_size, len(self.vectors))])
+        if len(pending) > 0:
+            distances.append(nearest(*self.distances(queries, pending[None]), k))
+        distances = np.concatenate(distances, axis=1)
+        return nearest(distances, np.zeros(distances.shape, dtype=bool), min(k, len(self.vectors)))
+
+    def tree_query(self, queries, k):
+        """
+        Find the distances to the k nearest valid rows of the tree, ignoring stale rows and vectors identical to
+        the query.  The archive can hold several copies of a query, e.g. once an unbounded archive is re-encoded,
+        so queries left with fewer than k valid candidates are asked again for twice as many, until they have
+        enough or the whole tree was searched.
+        :param queries: array of latent vectors of shape (N, D).
+        :param k: number of neighbours.
+        :return: array of shape (N, min(k, tree size)) of ascending distances, padded with infinity.
+        """
+        stale = np.array(sorted(self.stale), dtype=int)
+        distances = np.full((len(queries), min(k, self.tree_size)), np.inf, dtype=queries.dtype)
+        remaining = np.arange(len(queries))
+        count = min(k + 1 + len(stale), self.tree_size)
+        while len(remaining) > 0:
+            candidates = self.tree.query(np.asarray(queries[remaining], dtype=float), k=count, return_distance=False)
+            ignored = np.isin(candidates, stale)
+            candidate_distances, identical = self.distances(queries[remaining], np.where(ignored, 0, candidates))
+            excluded = identical | ignored
+            distances[remaining] = nearest(candidate_distances, excluded, k)
+            if count == self.tree_size:
+                break
+            remaining = remaining[np.sum(~excluded, axis=1) < k]
+            count = min(2 * count, self.tree_size)
+        return distances
+
+
+neighbour_indices = {'brute': BruteForceIndex, 'tree': BallTreeIndex}
+
+
+def create_index(name):
+    """
+    :param name: name of the nearest neighbour backend, as given by novelty_index in Delenox_Config.
+    :return: an empty nearest neighbour index.
+    """
+    return neighbour_indices[name]()
+
+
+def benchmark_indices(archive_sizes=(1000, 10000, 20000), population=200, generations=5):
+    """
+    Time the novelty queries of a generation against archives of increasing size for every backend,
+    checking that all backends agree with the brute-force index.  A tenth of the queries also have several exact
+    copies in the archive, as they do once an unbounded archive is re-encoded, so that every backend must still
+    find k neighbours other than the copies.
+    :param archive_sizes: sizes of the archives to benchmark.
+    :param population: number of query vectors per generation.
+    :param generations: number of generations to simulate, each adding population / 100 vectors.
+    """
+    for size in archive_sizes:
+        archive = np.random.normal(size=(size, compressed_length)).astype(np.float32)
+        queries = np.random.normal(size=(population, compressed_length)).astype(np.float32)
+        archive = np.concatenate([archive, np.repeat(queries[:max(1, population // 10)], 3, axis=0)])
+        reference = None
+        for name in neighbour_indices.keys():
+            index = create_index(name)
+            start = time.time()
+            index.rebuild(archive)
+            build = time.time() - start
+            start = time.time()
+            vectors = archive
+            for generation in range(generations):
+                result = index.query(queries)
+                vectors = np.concatenate([vectors, queries[:max(1, population // 100)] + generation + 1])
+                index.update(vectors)
+            elapsed = (time.time() - start) / generations
+            if reference is None:
+                reference = result
+            print("Archive {:d} - {}: build {:.2f}s, generation {:.2f}s, matches brute force: {}".format(
+                size, name, build, elapsed, np.array_equal(reference, result)))
+
+
+if __name__ == "__main__":
+    benchmark_indices()
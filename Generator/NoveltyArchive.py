@@ -0,0 +1,282 @@
+from collections import Counter
+
+import numpy as np
+
+from Generator.Delenox_Config import novelty_index, k_nearest_neighbors, archive_capacity, archive_eviction, \
+    archive_exemplars, latent_precision
+from Generator.LatentPrecision import latent_dtypes, quantize, dequantize
+from Generator.NeighbourIndex import create_index
+
+
+class NoveltyArchive:
+    """
+    Archive of past novel individuals.  Latent vectors are stored as rows of a preallocated matrix which doubles
+    in size whenever it fills up, alongside the lattice, novelty score, phase and insertion order of each
+    individual.  Duplicates are detected by hashing the bytes of each vector rather than comparing it to every
+    stored vector, and the archive keeps a nearest neighbour index over its matrix up to date.
+
+    Vectors are stored in float32 by default, or quantized to float16 or int8 (with one scale per vector) to
+    reduce the memory of large archives, in which case the index compares queries to the quantized vectors.
+
+    An archive with a capacity evicts an individual for every new one once it is full, following its eviction
+    policy: 'fifo' evicts the oldest individual, 'reservoir' keeps a uniform random sample of every individual
+    offered to the archive and 'least_novel' evicts the individual with the lowest novelty score.  The most novel
+    exemplars of each phase can be protected from eviction.
+
+    Every row appended or evicted since the archive was last re-encoded or cleared is logged, so that copies of
+    the archive, e.g. projected by a NoveltyProjection, can follow its changes.
+
+    An unbounded archive also remembers every lattice offered to it, including those whose latent vector was
+    already archived, as the original list of archived lattices did.  These lattices are returned for training and
+    each become a row of their own when the archive is re-encoded.
+    """
+    def __init__(self, capacity=archive_capacity, eviction=archive_eviction, exemplars=archive_exemplars,
+                 index_name=novelty_index, precision=latent_precision, rows=1024):
+        self.capacity = capacity
+        self.precision = precision
+        self.eviction = eviction
+        self.exemplars = exemplars
+        self.index_name = index_name
+        self.rows = rows
+        self.vectors = None
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.novelty = np.zeros(0)
+        self.phases = np.zeros(0, dtype=int)
+        self.order = np.zeros(0, dtype=int)
+        self.lattices = []
+        self.keys = []
+        self.history = []
+        self.hashes = Counter()
+        self.size = 0
+        self.offered = 0
+        self.evicted = 0
+        self.revision = 0
+        self.log = []
+        self.index = create_index(index_name)
+
+    def add(self, vector, novelty=0.0, phase=0, lattice=None):
+        """
+        Insert an individual into the archive unless an identical latent vector is already stored, evicting
+        another individual first if the archive is full.
+        :param vector: latent vector of the individual.
+        :param novelty: novelty score of the individual when it was archived.
+        :param phase: phase in which the individual was archived.
+        :param lattice: lattice of the individual, kept so the archive can be re-encoded by later encoders.
+        :return: True if the individual was inserted, False if it is a duplicate or was turned away.
+        """
+        if self.capacity is None:
+            self.history.append((lattice, novelty, phase))
+        vector, scale = quantize(np.reshape(vector, -1), self.precision)
+        key = vector_key(vector, scale)
+        if key in self.hashes:
+            return False
+        self.offered += 1
+
+        if self.capacity is not None and self.size >= self.capacity:
+            victim = self.choose_victim(novelty)
+            if victim is None:
+                return False
+            self.remove(victim)
+
+        if self.vectors is None:
+            self.vectors = np.zeros((0, len(vector)), dtype=latent_dtypes[self.precision])
+        if self.size == len(self.vectors):
+            self.grow(max(self.rows, 2 * len(self.vectors)))
+        self.vectors[self.size] = vector
+        self.scales[self.size] = scale
+        self.novelty[self.size] = novelty
+        self.phases[self.size] = phase
+        self.order[self.size] = self.offered
+        self.lattices.append(lattice)
+        self.keys.append(key)
+        self.hashes[key] += 1
+        self.size += 1
+        self.log.append(('add', self.size - 1))
+        self.index.update(self.as_array(), self.index_scales())
+        return True
+
+    def grow(self, rows):
+        """
+        Reallocate the storage of the archive to the given number of rows, keeping the stored individuals.
+        :param rows: new number of rows.
+        """
+        vectors = np.zeros((rows, self.vectors.shape[1]), dtype=self.vectors.dtype)
+        vectors[:self.size] = self.vectors[:self.size]
+        self.vectors = vectors
+        for name in ['scales', 'novelty', 'phases', 'order']:
+            values = getattr(self, name)
+            grown = np.zeros(rows, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            setattr(self, name, grown)
+
+    def choose_victim(self, novelty):
+        """
+        :param novelty: novelty score of the individual about to be inserted into the full archive.
+        :return: row of the individual to evict, or None if the new individual should be turned away instead.
+        """
+        candidates = np.flatnonzero(~self.protected())
+        if len(candidates) == 0:
+            return None
+        if self.eviction == 'fifo':
+            return candidates[np.argmin(self.order[candidates])]
+        if self.eviction == 'reservoir':
+            if np.random.random() >= self.capacity / self.offered:
+                return None
+            return np.random.choice(candidates)
+        if self.eviction == 'least_novel':
+            victim = candidates[np.argmin(self.novelty[candidates])]
+            return victim if self.novelty[victim] < novelty else None
+        raise ValueError("Unknown archive eviction policy: {}".format(self.eviction))
+
+    def protected(self):
+        """
+        :return: boolean mask of the rows holding the most novel exemplars of each phase.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        if self.exemplars <= 0:
+            return mask
+        phases = self.phases[:self.size]
+        for phase in np.unique(phases):
+            rows = np.flatnonzero(phases == phase)
+            mask[rows[np.argsort(-self.novelty[rows], kind='stable')[:self.exemplars]]] = True
+        return mask
+
+    def remove(self, row):
+        """
+        Evict an individual, moving the last row of the archive into its place.
+        :param row: row of the individual to evict.
+        """
+        last = self.size - 1
+        self.hashes[self.keys[row]] -= 1
+        if self.hashes[self.keys[row]] == 0:
+            del self.hashes[self.keys[row]]
+        for values in [self.vectors, self.scales, self.novelty, self.phases, self.order]:
+            values[row] = values[last]
+        self.lattices[row] = self.lattices[last]
+        self.keys[row] = self.keys[last]
+        self.lattices.pop()
+        self.keys.pop()
+        self.size -= 1
+        self.evicted += 1
+        self.log.append(('remove', row))
+        self.index.remove(self.as_array(), self.index_scales(), row)
+
+    def reencode(self, vectors):
+        """
+        Replace the latent vector of every archived individual, e.g. with the current encoder's interpretation
+        of the archived lattices, and rebuild the nearest neighbour index from scratch.  With the 'least_novel'
+        eviction policy, the novelty of every individual is replaced by its novelty within the re-encoded archive.
+        :param vectors: new latent vectors of the lattices given by archived_lattices, in the same order.
+        """
+        if self.capacity is None and len(self.history) > self.size:
+            self.grow(max(len(self.vectors), len(self.history)))
+            self.size = len(self.history)
+            self.lattices = [lattice for lattice, _, _ in self.history]
+            self.keys = [None] * self.size
+            self.novelty[:self.size] = [novelty for _, novelty, _ in self.history]
+            self.phases[:self.size] = [phase for _, _, phase in self.history]
+            self.order[:self.size] = np.arange(1, self.size + 1)
+        self.hashes.clear()
+        for row, vector in enumerate(vectors):
+            self.vectors[row], self.scales[row] = quantize(np.reshape(vector, -1), self.precision)
+            self.keys[row] = vector_key(self.vectors[row], self.scales[row])
+            self.hashes[self.keys[row]] += 1
+        self.revision += 1
+        self.log = []
+        self.index.rebuild(self.as_array(), self.index_scales())
+
+        # Novelty recorded under an earlier encoder is not comparable with the scores of the current one, so an
+        # archive evicting its least novel individuals re-scores them against the re-encoded archive.
+        if self.eviction == 'least_novel' and self.size > 0:
+            distances = self.index.query(self.dequantized(), k_nearest_neighbors)
+            self.novelty[:self.size] = [np.average(row[np.isfinite(row)]) if np.isfinite(row).any() else 0
+                                        for row in distances]
+
+    def archived_lattices(self):
+        """
+        :return: list of every lattice offered to an unbounded archive, or of the lattices stored in a bounded one.
+        """
+        if self.capacity is None:
+            return [lattice for lattice, _, _ in self.history]
+        return list(self.lattices)
+
+    def clear(self):
+        self.size = 0
+        self.lattices = []
+        self.keys = []
+        self.history = []
+        self.hashes.clear()
+        self.revision += 1
+        self.log = []
+        self.index = create_index(self.index_name)
+
+    def as_array(self):
+        """
+        :return: view of the stored latent vectors, of shape (size, latent length), at the storage precision.
+        """
+        if self.vectors is None:
+            return np.zeros((0, 0), dtype=latent_dtypes[self.precision])
+        return self.vectors[:self.size]
+
+    def index_scales(self):
+        """
+        :return: scales of the stored vectors for the nearest neighbour index, or None at full precision.
+        """
+        return None if self.precision == 'float32' else self.scales[:self.size]
+
+    def dequantized(self):
+        """
+        :return: float32 copy of the stored latent vectors.
+        """
+        return dequantize(self.as_array(), self.scales[:self.size])
+
+    def find(self, vectors):
+        """
+        :param vectors: latent vectors to look up.
+        :return: array holding the archive row of each vector, or -1 for vectors which are not archived.
+        """
+        rows = {key: row for row, key in enumerate(self.keys)}
+        codes, scales = quantize(np.reshape(vectors, (len(vectors), -1)), self.precision)
+        return np.array([rows.get(vector_key(code, scale), -1) for code, scale in zip(codes, scales)], dtype=int)
+
+    def query(self, queries, k=k_nearest_neighbors):
+        """
+        :param queries: array of latent vectors of shape (N, D).
+        :param k: number of neighbours.
+        :return: distances from each query to its k nearest vectors of the archive, as given by the index.
+        """
+        return self.index.query(queries, k)
+
+    def __getstate__(self):
+        # Only the filled rows are pickled and the index is rebuilt on loading, keeping checkpoints small.
+        state = self.__dict__.copy()
+        state['vectors'] = None if self.vectors is None else self.as_array().copy()
+        for name in ['scales', 'novelty', 'phases', 'order']:
+            state[name] = getattr(self, name)[:self.size].copy()
+        state['index'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'revision' not in state:
+            self.revision = 0
+            self.log = []
+        if 'history' not in state:
+            self.history = list(zip(self.lattices, self.novelty, self.phases)) if self.capacity is None else []
+        self.index = create_index(self.index_name)
+        self.index.rebuild(self.as_array(), self.index_scales())
+
+    def __getitem__(self, item):
+        return self.as_array()[item]
+
+    def __len__(self):
+        return self.size
+
+
+def vector_key(vector, scale):
+    """
+    :param vector: latent vector at its storage precision.
+    :param scale: float32 scale of the vector.
+    :return: bytes identifying the vector, where adding zero maps -0.0 to 0.0 so equal vectors share a key.
+    """
+    return (vector + vector.dtype.type(0)).tobytes() + (scale + np.float32(0)).tobytes()
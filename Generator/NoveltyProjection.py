@@ -0,0 +1,85 @@
+import numpy as np
+
+from Generator.Delenox_Config import novelty_projection, projection_dimensions
+from Generator.LatentPrecision import dequantize
+from Generator.NeighbourIndex import BruteForceIndex
+
+
+class NoveltyProjection:
+    """
+    Linear projection of latent vectors to a lower dimensional space in which novelty is cheaper to compute.
+    'pca' keeps the principal components of the vectors it is fitted on, whereas 'random' draws a Gaussian
+    random projection, which preserves distances in expectation, every time it is fitted.
+
+    The projection keeps the projected vectors of the archive it scores against, with an index over them, and
+    only projects the individuals added to the archive since it was last used.  They are projected from scratch
+    after the projection is refitted or the archive is re-encoded.
+    """
+    def __init__(self, method=novelty_projection, dimensions=projection_dimensions, seed=0):
+        self.method = method
+        self.dimensions = dimensions
+        self.seed = seed
+        self.fits = 0
+        self.mean = None
+        self.components = None
+        self.archive_state = None
+        self.projected = None
+        self.index = BruteForceIndex()
+
+    def fit(self, vectors):
+        """
+        :param vectors: latent vectors of the archive and population, of shape (N, D).
+        """
+        vectors = np.asarray(vectors, dtype=float).reshape(len(vectors), -1)
+        if self.method == 'pca':
+            self.mean = np.mean(vectors, axis=0)
+            _, _, components = np.linalg.svd(vectors - self.mean, full_matrices=False)
+            self.components = components[:self.dimensions].T
+        elif self.method == 'random':
+            self.mean = np.zeros(vectors.shape[1])
+            generator = np.random.RandomState(self.seed + self.fits)
+            self.components = generator.normal(size=(vectors.shape[1], self.dimensions)) / np.sqrt(self.dimensions)
+        else:
+            raise ValueError("Unknown novelty projection: {}".format(self.method))
+        self.fits += 1
+        self.archive_state = None
+
+    def transform(self, vectors):
+        """
+        Project latent vectors.  Identical vectors are projected once, so they remain identical afterwards.
+        :param vectors: latent vectors of shape (N, D).
+        :return: float32 projected vectors of shape (N, dimensions).
+        """
+        if len(vectors) == 0:
+            return np.zeros((0, self.components.shape[1]), dtype=np.float32)
+        vectors = np.asarray(vectors, dtype=float).reshape(len(vectors), -1)
+        unique, inverse = np.unique(vectors + 0.0, axis=0, return_inverse=True)
+        return ((unique - self.mean) @ self.components).astype(np.float32)[np.reshape(inverse, -1)]
+
+    def project_archive(self, archive):
+        """
+        Bring the projected copy of the archive up to date, replaying the rows appended to or evicted from the
+        archive since the last call so that only the new individuals are projected.
+        :param archive: the novelty archive.
+        :return: index over the projected vectors of the archive, in the same order as the archive's rows.
+        """
+        if self.archive_state is None or self.archive_state[:2] != (self.fits, archive.revision):
+            self.projected = self.transform(archive.dequantized())
+        elif len(archive.log) > self.archive_state[2]:
+            # Row of the previous projected copy now held by each row of the archive, or -1 for new individuals.
+            origins = list(range(len(self.projected)))
+            for operation, row in archive.log[self.archive_state[2]:]:
+                if operation == 'add':
+                    origins.append(-1)
+                else:
+                    origins[row] = origins[-1]
+                    origins.pop()
+            origins = np.asarray(origins, dtype=int)
+            projected = np.zeros((len(origins), self.projected.shape[1]), dtype=np.float32)
+            projected[origins >= 0] = self.projected[origins[origins >= 0]]
+            new = np.flatnonzero(origins < 0)
+            projected[new] = self.transform(dequantize(archive.as_array()[new], archive.scales[new]))
+            self.projected = projected
+        self.archive_state = (self.fits, archive.revision, len(archive.log))
+        self.index.rebuild(self.projected)
+        return self.index
@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+from keras.utils import Sequence
+
+from Generator.Delenox_Config import batch_size, replay_sampling
+from Generator.LatticeDedup import LatticeIndex
+
+
+def extract_shard(path):
+    """
+    Memory-map the lattices of a training set shard.  Compressed .npz archives cannot be memory-mapped, so the
+    lattices are extracted once to an uncompressed .npy file next to the shard, which is refreshed whenever the
+    shard is rewritten.
+    :param path: path of a Training_Set.npz file.
+    :return: read-only memory-mapped array of the shard's lattices.
+    """
+    extracted = os.path.splitext(path)[0] + ".npy"
+    if not os.path.exists(extracted) or os.path.getmtime(extracted) < os.path.getmtime(path):
+        with open(extracted + ".tmp", "wb") as file:
+            np.save(file, np.load(path)['arr_0'])
+        os.replace(extracted + ".tmp", extracted)
+    return np.load(extracted, mmap_mode='r')
+
+
+def replay_sample(sizes, capacity, sampling=replay_sampling, seed=29):
+    """
+    Choose which lattices of previous phases to replay, stratifying the sample by phase.
+    :param sizes: number of lattices in each previous phase's shard.
+    :param capacity: total number of lattices to replay.
+    :param sampling: 'uniform' to give each phase an equal share, handing the share of phases which are too small
+    to the others, or 'proportional' to give each phase a share proportional to its size.
+    :param seed: seed of the random sample, which is combined with the number of previous phases so that the
+    replayed lattices of each phase change from one phase to the next.
+    :return: list of the sorted indices of the replayed lattices of each shard.
+    """
+    sizes = np.asarray(sizes, dtype=int)
+    target = min(capacity, int(np.sum(sizes)))
+    if sampling == 'uniform':
+        quotas = np.zeros(len(sizes), dtype=int)
+        while np.sum(quotas) < target:
+            available = np.flatnonzero(quotas < sizes)
+            share = max((target - np.sum(quotas)) // len(available), 1)
+            for index in available[:target - np.sum(quotas)]:
+                quotas[index] = min(sizes[index], quotas[index] + share)
+    elif sampling == 'proportional':
+        shares = sizes * target / max(np.sum(sizes), 1)
+        quotas = np.floor(shares).astype(int)
+        quotas[np.argsort(quotas - shares)[:target - np.sum(quotas)]] += 1
+    else:
+        raise ValueError("Unknown replay sampling: {}".format(sampling))
+
+    generator = np.random.RandomState([seed, len(sizes)])
+    return [np.sort(generator.choice(size, quota, replace=False)) for size, quota in zip(sizes, quotas)]
+
+
+class TrainingShards:
+    """
+    Training set made of the lattices of several phases, kept on disk as one shard per phase and read a batch at
+    a time, so the full history is never stacked in memory.  Lattices are split into a training and validation
+    set once, using the same fraction and seed as the in-memory train_test_split.  Shards may also be given as
+    arrays already in memory.  Duplicate buildings, including mirrored and rotated ones, can be reduced to their
+    first copy, optionally weighting it by its number of copies.  With a replay capacity, every shard but the
+    last (the newest phase) only contributes a stratified sample of its lattices.
+    """
+    def __init__(self, shards, validation=0.2, seed=29, replay=None, sampling=replay_sampling, unique=False,
+                 weighted=False, weights=None):
+        self.shards = [extract_shard(shard) if isinstance(shard, str) else shard for shard in shards]
+        self.selected = [np.arange(len(shard)) for shard in self.shards]
+        if weights is not None:
+            weights = [np.asarray(shard_weights, dtype=np.float32) for shard_weights in weights]
+        if unique:
+            index = LatticeIndex()
+            keys = []
+            for number, shard in enumerate(self.shards):
+                kept = [(row, key) for row, (key, new) in enumerate(map(index.add, shard)) if new]
+                self.selected[number] = np.asarray([row for row, _ in kept], dtype=int)
+                keys.append([key for _, key in kept])
+            if weighted:
+                weights = [np.asarray([index.counts[key] for key in shard_keys], dtype=np.float32)
+                           for shard_keys in keys]
+        if replay is not None:
+            replayed = replay_sample([len(selected) for selected in self.selected[:-1]], replay, sampling, seed)
+            if weights is not None:
+                weights[:-1] = [shard_weights[rows] for shard_weights, rows in zip(weights, replayed)]
+            self.selected[:-1] = [selected[rows] for selected, rows in zip(self.selected, replayed)]
+        # Sample weight of every selected lattice, in the order of the concatenation of the shards
+        self.weights = None if weights is None else np.concatenate(weights)
+        self.offsets = np.cumsum([0] + [len(selected) for selected in self.selected])
+        order = np.random.RandomState(seed).permutation(self.offsets[-1])
+        split = int(np.ceil(len(order) * validation))
+        self.validation_rows = np.sort(order[:split])
+        self.training_rows = order[split:]
+        self.seed = seed
+
+    def gather(self, rows):
+        """
+        :param rows: indices of lattices across the concatenation of the lattices selected from each shard.
+        :return: float32 array of the lattices, in the given order.
+        """
+        shard = np.searchsorted(self.offsets, rows, side='right') - 1
+        lattices = np.empty((len(rows),) + self.shards[0].shape[1:], dtype=np.float32)
+        for index in np.unique(shard):
+            selected = shard == index
+            lattices[selected] = self.shards[index][self.selected[index][rows[selected] - self.offsets[index]]]
+        return lattices
+
+    def training(self, batch=batch_size, noise=None):
+        return ShardSequence(self, self.training_rows, batch, noise, shuffle=True)
+
+    def validation(self, batch=batch_size, noise=None):
+        return ShardSequence(self, self.validation_rows, batch, noise, shuffle=False)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+
+class ShardSequence(Sequence):
+    """
+    Keras sequence of (input, target) batches, or (input, target, weight) batches if the shards are weighted,
+    drawn from a subset of TrainingShards.  The training subset is
+    reshuffled at the end of every epoch.  Noise is drawn with a generator seeded by the batch and, for training
+    batches only, the epoch, so training noise is redrawn every epoch while validation noise stays fixed.
+    """
+    def __init__(self, shards, rows, batch, noise=None, shuffle=True):
+        super().__init__()
+        self.shards = shards
+        self.rows = np.array(rows)
+        self.batch = batch
+        self.noise = noise
+        self.shuffle = shuffle
+        self.epoch = 0
+
+    def __len__(self):
+        return int(np.ceil(len(self.rows) / self.batch))
+
+    def __getitem__(self, index):
+        rows = self.rows[index * self.batch:(index + 1) * self.batch]
+        targets = self.shards.gather(rows)
+        inputs = targets
+        if self.noise is not None:
+            generator = np.random.RandomState([self.shards.seed, self.epoch if self.shuffle else 0, index])
+            inputs = self.noise(targets, generator)
+        if self.shards.weights is None:
+            return inputs, targets
+        # Weights are given one axis per voxel axis so they broadcast over the loss of every voxel.
+        return inputs, targets, self.shards.weights[rows].reshape((-1,) + (1,) * (targets.ndim - 2))
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        if self.shuffle:
+            np.random.RandomState(self.shards.seed + self.epoch).shuffle(self.rows)
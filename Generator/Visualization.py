@@ -66,11 +66,7 @@ def expressive_graph(fig, ax, x, y, title, x_label, y_label):
 
 
 def convert_to_integer(lattice):
-    integer_reconstruct = np.zeros(lattice_dimensions)
-    for channel in range(20):
-        for row in range(20):
-            integer_reconstruct[channel][row] = np.argmax(lattice[channel][row], axis=1)
-    return integer_reconstruct
+    return np.asarray(np.argmax(lattice, axis=-1), dtype=float)
 
 
 def auto_encoder_plot(example, code, reconstruction, error, title=""):